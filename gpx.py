@@ -1,33 +1,75 @@
-import gpxpy
-import gpxpy.gpx
+import io
+import math
+import os
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import BinaryIO, Iterator
+from xml.parsers import expat
+
+import numpy as np
 from gpxpy.gpx import GPXTrackSegment, GPXTrackPoint
+from gpxpy.gpxfield import parse_time
 
 from provider import get_locations_elevations
-from utils import haversine, calculate_gradient
+from utils import haversine, calculate_gradient, calculate_route_geo_data, douglas_peucker, moving_average, deprecated
+from utils import filter_elevation_diffs
+from utils import get_cache_key, load_cache, save_cache
+
+# Bump when the processing changes, so routes cached by previous versions are not reused
+ROUTES_CACHE_VERSION = 3
+
+# Track segments with more points than this are simplified when a simplification epsilon is given
+SIMPLIFY_MIN_POINTS = 1000
 
 
 class GPXError(Exception):
     pass
 
 
-class RoutePoint(GPXTrackPoint):
+class RoutePoint:
     """
-    Represents a point on a route, extending a GPX track point by adding
+    Represents a point on a route, wrapping a GPX track point by adding
     distance, cumulative distance, and grade calculations.
+
+    The GPX track point is referenced rather than copied: location, elevation and time are
+    read from it, and any other attribute is delegated to it.
     """
+    __slots__ = ("gpx_point", "distance", "cumulative_distance", "grade")
 
     def __init__(self, gpx_point: GPXTrackPoint):
-        super().__init__(
-            gpx_point.latitude, gpx_point.longitude, gpx_point.elevation,
-            gpx_point.time, gpx_point.symbol, gpx_point.comment,
-            gpx_point.horizontal_dilution, gpx_point.vertical_dilution, gpx_point.position_dilution,
-            gpx_point.speed, gpx_point.name
-        )
+        self.gpx_point = gpx_point
 
         self.distance = 0
         self.cumulative_distance = 0
         self.grade = 0
 
+    @property
+    def latitude(self) -> float:
+        return self.gpx_point.latitude
+
+    @property
+    def longitude(self) -> float:
+        return self.gpx_point.longitude
+
+    @property
+    def elevation(self) -> float | None:
+        return self.gpx_point.elevation
+
+    @property
+    def time(self) -> datetime | None:
+        return self.gpx_point.time
+
+    def __getattr__(self, name: str):
+        # Only called for missing attributes; the wrapped point itself is not delegated,
+        # so copies and unpickled instances that do not have it yet fail normally
+        if name == "gpx_point":
+            raise AttributeError(name)
+
+        return getattr(self.gpx_point, name)
+
+    @deprecated("Use utils.calculate_route_geo_data to calculate the values of all the points at once.")
     def calculate_distance_and_grade(self, previous_point: 'RoutePoint'):
         """
         Calculate the distance and grade between this point and a previous point.
@@ -57,14 +99,64 @@ class RoutePoint(GPXTrackPoint):
         return self.elevation - previous_point.elevation
 
 
+class PointArrays:
+    """
+    Represents the points of a track segment as a structure of arrays, holding one
+    NumPy array per attribute instead of one Python object per point.
+    """
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, elevations: np.ndarray, times: np.ndarray):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.elevations = elevations
+        self.times = times
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def take(self, indexes: np.ndarray) -> 'PointArrays':
+        """
+        Select a subset of the points.
+
+        Parameters:
+            indexes (np.ndarray): The indexes of the points to select, in route order.
+
+        Returns:
+            PointArrays: A new instance holding only the selected points.
+        """
+        return PointArrays(
+            self.latitudes[indexes], self.longitudes[indexes], self.elevations[indexes], self.times[indexes]
+        )
+
+
+class RouteData:
+    """
+    Holds the points of a track segment together with the distance, elevation difference,
+    grade and cumulative distance of each point, as parallel arrays shared by all the
+    route segments built from it.
+    """
+
+    def __init__(self, points: PointArrays, distances: np.ndarray, elevation_diffs: np.ndarray,
+                 grades: np.ndarray, cumulative_distances: np.ndarray):
+        self.points = points
+        self.distances = distances
+        self.elevation_diffs = elevation_diffs
+        self.grades = grades
+        self.cumulative_distances = cumulative_distances
+
+    def __len__(self):
+        return len(self.points)
+
+
 class RouteSegment:
     """
     Represents a segment of a route, handling points, distances, grades,
     and elevation statistics calculations.
     """
 
-    def __init__(self, gpx_segment: GPXTrackSegment):
+    def __init__(self, gpx_segment: GPXTrackSegment | None = None):
         self._gpx_segment = gpx_segment
+        self.__last_point_index = len(gpx_segment.points) - 1 if gpx_segment is not None else None
 
         self.number: int | None = None
 
@@ -88,39 +180,47 @@ class RouteSegment:
 
         self.duration: str = ""
 
-        self.__start_point = None
-        self.__end_point = None
-        self.__points: list[RoutePoint] = []
+        # Only the first and last points are kept, with running aggregates for the rest
+        self.__start_point: RoutePoint | None = None
+        self.__end_point: RoutePoint | None = None
+        self.__points_count = 0
 
-        self.__grades: list[float] = []
+        self.__grades_sum = 0.0
+        self.__lowest_grade = math.inf
+        self.__highest_grade = -math.inf
 
-    def __calculate_duration(self) -> str | None:
-        if self.__start_point.time and self.__end_point.time:
-            difference_seconds = self.__start_point.time_difference(self.__end_point)
+        self.__lowest_elevation = math.inf
+        self.__highest_elevation = -math.inf
+
+    def __calculate_duration(self, start_time: datetime | None, end_time: datetime | None):
+        if start_time and end_time:
+            difference_seconds = abs((end_time - start_time).total_seconds())
             hours, remainder = divmod(difference_seconds, 3600)
             minutes, seconds = divmod(remainder, 60)
 
             self.duration = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
 
     def __calculate_statistics(self):
-        elevations = [p.elevation for p in self.__points]
-
-        self.min_elevation = min(elevations)
-        self.max_elevation = max(elevations)
+        self.min_elevation = self.__lowest_elevation
+        self.max_elevation = self.__highest_elevation
 
-        self.avg_grade = sum(self.__grades) / len(self.__grades) if self.__grades else 0
-        self.min_grade = min(self.__grades) if self.__grades else 0
-        self.max_grade = max(self.__grades) if self.__grades else 0
+        self.avg_grade = self.__grades_sum / self.__points_count if self.__points_count else 0
+        self.min_grade = self.__lowest_grade if self.__points_count else 0
+        self.max_grade = self.__highest_grade if self.__points_count else 0
 
-    def calculate_elevation_gain_and_loss(self, point: RoutePoint, previous_point: RoutePoint):
+    def calculate_elevation_gain_and_loss(self, point: RoutePoint, previous_point: RoutePoint,
+                                          elevation_diff: float | None = None):
         """
         Calculate the elevation gain and loss between two points.
     
         Parameters:
             point (RoutePoint): The current point in the segment.
             previous_point (RoutePoint): The previous point in the segment.
+            elevation_diff (float | None): The elevation difference between both points, if it
+                                           was already calculated.
         """
-        elevation_diff = point.get_elevation_difference(previous_point)
+        if elevation_diff is None:
+            elevation_diff = point.get_elevation_difference(previous_point)
 
         if elevation_diff > 0:
             self.elevation_gain += elevation_diff
@@ -129,16 +229,30 @@ class RouteSegment:
 
     def add_point(self, point: RoutePoint):
         """
-        Add a point to the segment, updating the list of points, grades,
-        and cumulative distance.
+        Add a point to the segment, updating its start and end points, cumulative
+        distance, and grade and elevation aggregates.
     
         Parameters:
             point (RoutePoint): The point to be added to the segment.
         """
-        self.__points.append(point)
-        self.__grades.append(point.grade)
+        if self.__start_point is None:
+            self.__start_point = point
+        self.__end_point = point
+        self.__points_count += 1
 
-        self.distance = sum([p.distance for p in self.__points])
+        self.distance += point.distance
+
+        # Grade and elevation aggregates are tracked as points are added, so no extra pass is needed at the end
+        self.__grades_sum += point.grade
+        if point.grade < self.__lowest_grade:
+            self.__lowest_grade = point.grade
+        if point.grade > self.__highest_grade:
+            self.__highest_grade = point.grade
+
+        if point.elevation < self.__lowest_elevation:
+            self.__lowest_elevation = point.elevation
+        if point.elevation > self.__highest_elevation:
+            self.__highest_elevation = point.elevation
 
     def is_completed(self, current_point_index, max_length: float):
         """
@@ -153,24 +267,93 @@ class RouteSegment:
         """
         return (
                 self.distance >= max_length
-                or current_point_index == len(self._gpx_segment.points) - 1
-                and len(self.__points) >= 2
+                or (current_point_index == self.__last_point_index and self.__points_count >= 2)
         )
 
     def calculate_points_data(self):
         """
-        Perform final calculations for the segment, setting start/end points,
+        Perform final calculations for the segment, setting start/end elevations,
         duration, elevation statistics, and grades.
         """
-        self.__start_point = self.__points[0]
-        self.__end_point = self.__points[-1]
-
         self.start_elevation = self.__start_point.elevation
         self.end_elevation = self.__end_point.elevation
 
-        self.__calculate_duration()
+        self.__calculate_duration(self.__start_point.time, self.__end_point.time)
         self.__calculate_statistics()
 
+    @classmethod
+    def from_route_data(cls, data: RouteData, bounds: list[tuple[int, int]]) -> list['RouteSegment']:
+        """
+        Build the segments covering consecutive ranges of the precomputed route data, as an
+        alternative to adding their points one by one with `add_point`.
+
+        Parameters:
+            data (RouteData): The points of the track segment and their precomputed distances and grades.
+            bounds (list[tuple[int, int]]): The contiguous `(start, stop)` indexes of the points in each
+                                            segment, as returned by `get_segments_bounds`. The distance of
+                                            a segment is measured from the point before its start.
+
+        Returns:
+            list[RouteSegment]: The segments, in the same order as their bounds.
+
+        The statistics of all segments are calculated together with one `reduceat` per statistic,
+        which reduces every range in a single pass instead of slicing the arrays once per segment.
+        """
+        if not bounds:
+            return []
+
+        starts = np.array([start for start, _ in bounds])
+        stops = np.array([stop for _, stop in bounds])
+
+        # Points after the last segment are left out, so the reduction of the last range ends with it
+        elevations = data.points.elevations[:stops[-1]]
+        elevation_diffs = data.elevation_diffs[:stops[-1]]
+        grades = data.grades[:stops[-1]]
+
+        distances = data.cumulative_distances[stops - 1] - data.cumulative_distances[starts - 1]
+        elevation_gains = np.add.reduceat(np.where(elevation_diffs > 0, elevation_diffs, 0), starts)
+        elevation_losses = np.add.reduceat(np.where(elevation_diffs < 0, -elevation_diffs, 0), starts)
+        avg_grades = np.add.reduceat(grades, starts) / (stops - starts)
+
+        statistics = zip(
+            distances.tolist(),
+            elevations[starts].tolist(), elevations[stops - 1].tolist(),
+            np.minimum.reduceat(elevations, starts).tolist(), np.maximum.reduceat(elevations, starts).tolist(),
+            elevation_gains.tolist(), elevation_losses.tolist(),
+            avg_grades.tolist(), np.minimum.reduceat(grades, starts).tolist(), np.maximum.reduceat(grades, starts).tolist(),
+            data.points.times[starts], data.points.times[stops - 1],
+        )
+
+        route_segments = []
+        for (distance, start_elevation, end_elevation, min_elevation, max_elevation, elevation_gain,
+             elevation_loss, avg_grade, min_grade, max_grade, start_time, end_time) in statistics:
+            route_segment = cls()
+
+            route_segment.distance = distance
+            route_segment.start_elevation = start_elevation
+            route_segment.end_elevation = end_elevation
+            route_segment.min_elevation = min_elevation
+            route_segment.max_elevation = max_elevation
+            route_segment.elevation_gain = elevation_gain
+            route_segment.elevation_loss = elevation_loss
+            route_segment.avg_grade = avg_grade
+            route_segment.min_grade = min_grade
+            route_segment.max_grade = max_grade
+            route_segment.__calculate_duration(start_time, end_time)
+
+            route_segments.append(route_segment)
+
+        return route_segments
+
+    def __getstate__(self):
+        return {**self.__dict__, "duration": self.duration}
+
+    def __setstate__(self, state: dict):
+        self.__init__()
+
+        for key, value in state.items():
+            setattr(self, key, value)
+
     @property
     def __dict__(self):
         return {
@@ -227,6 +410,15 @@ class Route:
         self.elevation_gain += segment.elevation_gain
         self.elevation_loss += segment.elevation_loss
 
+    def __getstate__(self):
+        return {**self.__dict__, "segments": self.segments}
+
+    def __setstate__(self, state: dict):
+        self.__init__()
+
+        for key, value in state.items():
+            setattr(self, key, value)
+
     @property
     def __dict__(self):
         return {
@@ -239,102 +431,401 @@ class Route:
         }
 
 
-def get_points_elevations(points: list[GPXTrackPoint]) -> list[GPXTrackPoint]:
+def get_points_elevations(points: PointArrays) -> PointArrays:
     """
-    Retrieve elevation data for a list of GPXTrackPoints.
+    Retrieve elevation data for the points of a track segment.
 
     Parameters:
-        points (list[GPXTrackPoint]): A list of GPXTrackPoint objects without elevation data.
+        points (PointArrays): The points of a track segment without elevation data.
 
     Returns:
-        list[GPXTrackPoint]: A list of GPXTrackPoint objects with updated elevation data.
+        PointArrays: The points with updated elevation data.
 
     The function performs the following steps:
-        1. Extracts latitude and longitude from each GPXTrackPoint to create a list of locations.
+        1. Extracts latitude and longitude from each point to create a list of locations.
         2. Calls the `get_locations_elevations` function to fetch elevation data for each location.
-        3. Constructs new GPXTrackPoint objects, adding the elevation values returned from the
-           elevation service.
+        3. Constructs new point arrays, adding the elevation values returned from the
+           elevation service. Times are kept when every location was returned.
     """
-    locations = [{"position": p_idx, "latitude": p.latitude, "longitude": p.longitude} for p_idx, p in
-                 enumerate(points)]
+    locations = [
+        {"position": p_idx, "latitude": latitude, "longitude": longitude}
+        for p_idx, (latitude, longitude) in enumerate(zip(points.latitudes.tolist(), points.longitudes.tolist()))
+    ]
     locations = get_locations_elevations(locations)
+    count = len(locations)
 
-    return [
-        GPXTrackPoint(
-            latitude=location["latitude"],
-            longitude=location["longitude"],
-            elevation=location["elevation"]
-        ) for location in locations
-    ]
+    return PointArrays(
+        np.fromiter((lo["latitude"] for lo in locations), dtype=np.float64, count=count),
+        np.fromiter((lo["longitude"] for lo in locations), dtype=np.float64, count=count),
+        np.fromiter((lo["elevation"] for lo in locations), dtype=np.float64, count=count),
+        points.times if count == len(points) else np.full(count, None, dtype=object),
+    )
 
 
-def get_routes(gpx_data: str, segment_length: float = 1.0) -> list[Route] | None:
+def get_valid_points(points: PointArrays) -> tuple[PointArrays, bool]:
     """
-    Parse GPX data and generate a list of Route objects, which are segmented based on a given maximum segment length.
+    Select the points of a track segment with valid elevation data, retrieving it first for
+    the points that lack it.
 
     Parameters:
-        gpx_data (str): The GPX data to be processed, provided as a string.
-        segment_length (float): The maximum length (in kilometers) for each segment in the route.
+        points (PointArrays): The points of a track segment.
 
     Returns:
-        list[Route] | None: A list of Route objects representing the parsed GPX data. Returns None if an error occurs.
+        tuple[PointArrays, bool]: The points with elevation data, and whether all the points have it.
+                                  Points whose elevation could not be retrieved are left out.
 
-    Raises:
-        GPXError: If there is an issue with parsing the GPX data or processing the routes.
+    Elevations that are missing or exactly 0 are considered invalid. They are found with a single
+    mask over the elevations array, and only those points are sent to the elevation providers.
+    """
+    missing = np.flatnonzero(np.isnan(points.elevations) | (points.elevations == 0.0))
 
-    The function processes the GPX data as follows:
-        1. Parses the GPX data string using the gpxpy library.
-        2. Creates `Route` objects for each track found in the GPX data.
-        3. Splits tracks into segments (`RouteSegment`) based on the specified maximum length.
-        4. Calculates statistics such as distance, elevation gain/loss, and duration for each segment.
-        5. Adds segments to their respective routes and returns the complete list of routes.
+    if len(missing):
+        retrieved = get_points_elevations(points.take(missing))
+
+        elevations = points.elevations.copy()
+        elevations[missing] = retrieved.elevations if len(retrieved) == len(missing) else np.nan
+
+        points = PointArrays(points.latitudes, points.longitudes, elevations, points.times)
+
+    valid = ~np.isnan(points.elevations)
+
+    return points.take(np.flatnonzero(valid)), bool(valid.all())
+
+
+def parse_point_time(text: str) -> datetime | None:
+    """
+    Parse the time of a track point.
+
+    Parameters:
+        text (str): The content of the point's time element.
+
+    Returns:
+        datetime | None: The parsed time. ISO 8601 times, as written by GPS devices, are parsed
+        natively, and any other format is left to gpxpy.
     """
+    # Before Python 3.11, `fromisoformat` does not accept the "Z" suffix used by nearly all GPX times
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+
     try:
-        gpx = gpxpy.parse(gpx_data)
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return parse_time(text)
+
+
+class GPXTracksParser:
+    """
+    Parses GPX data pushed to it in chunks with an expat parser, collecting the tracks
+    completed so far.
+
+    Only the name and description of each track, and the latitude, longitude, elevation and
+    time of its points are read. No element tree is built: each value is stored in the segment
+    buffers as soon as the parser reports it, so no object is kept per point besides them.
+    """
+
+    # Size of the chunks in which the GPX data is fed to the parser
+    chunk_size = 1 << 16
+
+    def __init__(self):
+        # GPX 1.0 and 1.1 use different namespaces, so tags are matched by their local name
+        self.__parser = expat.ParserCreate(namespace_separator="}")
+        self.__parser.buffer_text = True
+        self.__parser.StartElementHandler = self.__start_element
+        self.__parser.EndElementHandler = self.__end_element
+        self.__parser.CharacterDataHandler = self.__character_data
+
+        self.__tags: list[str] = []
+        self.__text: list[str] | None = None
+
+        self.__name = self.__description = None
+        self.__segments: list[PointArrays] = []
+        self.__latitudes, self.__longitudes, self.__elevations, self.__times = array("d"), array("d"), array("d"), []
+        self.__elevation = self.__time = None
+
+        self.tracks: list[tuple[str | None, str | None, list[PointArrays]]] = []
+
+    def feed(self, data: str | bytes, is_final: bool = False):
+        """
+        Parse a chunk of GPX data, adding the tracks it completes to `tracks`.
+
+        Parameters:
+            data (str | bytes): The next chunk of GPX data.
+            is_final (bool): Whether this is the last chunk of data.
+        """
+        self.__parser.Parse(data, is_final)
+
+    def __start_element(self, tag: str, attributes: dict[str, str]):
+        tag = tag.rpartition("}")[2]
+        parent_tag = self.__tags[-1] if self.__tags else None
+        self.__tags.append(tag)
+
+        if tag == "trkpt":
+            self.__latitudes.append(float(attributes["lat"]))
+            self.__longitudes.append(float(attributes["lon"]))
+            self.__elevation = self.__time = None
+        elif tag == "trkseg":
+            self.__latitudes, self.__longitudes, self.__elevations, self.__times = \
+                array("d"), array("d"), array("d"), []
+        elif tag == "trk":
+            self.__name = self.__description = None
+            self.__segments = []
+
+        # The text of the elements holding a needed value is collected until they end
+        if (parent_tag == "trkpt" and tag in ("ele", "time")) or (parent_tag == "trk" and tag in ("name", "desc")):
+            self.__text = []
+
+    def __character_data(self, data: str):
+        if self.__text is not None:
+            self.__text.append(data)
+
+    def __end_element(self, tag: str):
+        tag = self.__tags.pop()
+        text = None
+
+        if self.__text is not None:
+            text = "".join(self.__text) or None
+            self.__text = None
+
+        if tag == "trkpt":
+            self.__elevations.append(float(self.__elevation) if self.__elevation else np.nan)
+            self.__times.append(parse_point_time(self.__time) if self.__time else None)
+        elif not self.__tags:
+            return
+        elif self.__tags[-1] == "trkpt":
+            self.__end_point_value(tag, text)
+        elif tag == "trkseg":
+            segment_times = np.empty(len(self.__times), dtype=object)
+            segment_times[:] = self.__times
+
+            # Coordinates are packed as C doubles while parsing, so the arrays are built without conversion
+            self.__segments.append(PointArrays(
+                np.frombuffer(self.__latitudes, dtype=np.float64),
+                np.frombuffer(self.__longitudes, dtype=np.float64),
+                np.frombuffer(self.__elevations, dtype=np.float64),
+                segment_times,
+            ))
+        elif self.__tags[-1] == "trk":
+            self.__end_track_value(tag, text)
+        elif tag == "trk":
+            self.tracks.append((self.__name, self.__description, self.__segments))
+
+    def __end_point_value(self, tag: str, text: str | None):
+        # The values of a point are kept as text until the point ends
+        if tag == "ele":
+            self.__elevation = text
+        elif tag == "time":
+            self.__time = text
+
+    def __end_track_value(self, tag: str, text: str | None):
+        if tag == "name":
+            self.__name = text
+        elif tag == "desc":
+            self.__description = text
+
+
+def iter_tracks(gpx_data: str | bytes | BinaryIO) -> Iterator[tuple[str | None, str | None, list[PointArrays]]]:
+    """
+    Stream-parse GPX data, yielding its tracks one by one.
+
+    Parameters:
+        gpx_data (str | bytes | BinaryIO): The GPX data to be processed, provided as a string, as bytes,
+                                           or as a binary file object which is read incrementally.
+
+    Yields:
+        tuple[str | None, str | None, list[PointArrays]]: The name, description and segments of each track.
+
+    The data is fed to a `GPXTracksParser` in chunks, and each track is yielded as soon as
+    the chunk completing it has been parsed, while the following ones are still unread.
+    """
+    parser = GPXTracksParser()
+
+    if isinstance(gpx_data, (str, bytes)):
+        gpx_data = io.StringIO(gpx_data) if isinstance(gpx_data, str) else io.BytesIO(gpx_data)
+
+    while chunk := gpx_data.read(parser.chunk_size):
+        parser.feed(chunk)
+
+        yield from parser.tracks
+        parser.tracks.clear()
+
+    parser.feed(b"", is_final=True)
+    yield from parser.tracks
+
+
+def calculate_distances_and_grades(
+        points: PointArrays, smoothing_window: int = 1, min_elevation_delta: float = 0.0
+) -> RouteData:
+    """
+    Calculate the distance, elevation difference, grade and cumulative distance of every point
+    relative to its previous point, processing the whole track segment in a single vectorized pass.
+
+    Parameters:
+        points (PointArrays): The points of a track segment, in route order.
+        smoothing_window (int): The number of points averaged to smooth the elevation profile
+                                before calculating differences and grades. 1 disables smoothing.
+        min_elevation_delta (float): Elevation changes (in meters) smaller than this, measured from the
+                                     last counted elevation, are considered flat, so GPS noise does not
+                                     count as gain or loss. Grades are not affected.
+
+    Returns:
+        RouteData: The points with the distances (in kilometers), elevation differences (in meters),
+        grades (as percentages) and cumulative distances (in kilometers) of each point. The first
+        point has no previous point, so its distance, elevation difference and grade are 0.
+    """
+    elevations = moving_average(points.elevations, smoothing_window)
+    distances, elevation_diffs, grades = calculate_route_geo_data(points.latitudes, points.longitudes, elevations)
+
+    if min_elevation_delta:
+        elevation_diffs = filter_elevation_diffs(elevations, min_elevation_delta)
+
+    return RouteData(points, distances, elevation_diffs, grades, np.cumsum(distances))
+
+
+def get_segments_bounds(cumulative_distances: np.ndarray, segment_length: float) -> list[tuple[int, int]]:
+    """
+    Split a track segment into route segments of at least `segment_length` kilometers, using
+    its cumulative distances.
 
-        routes = []
-        # Process tracks
-        for track_idx, track in enumerate(gpx.tracks):
-            route = Route()
-            route.name = track.name
-            route.description = track.description
+    Parameters:
+        cumulative_distances (np.ndarray): The cumulative distance (in kilometers) at each point.
+        segment_length (float): The maximum length (in kilometers) for each segment in the route.
+
+    Returns:
+        list[tuple[int, int]]: The `(start, stop)` indexes of the points in each segment. The first
+        point is only used as reference for the second one, so no segment starts before index 1.
+
+    Each segment ends at the first point where its distance reaches `segment_length`, which is found
+    by a binary search over the cumulative distances instead of visiting every point. The last
+    segment may be shorter, as long as it has at least two points.
+    """
+    bounds = []
+    count = len(cumulative_distances)
+
+    start = 1
+    while start < count:
+        end = int(np.searchsorted(cumulative_distances, cumulative_distances[start - 1] + segment_length))
+        end = max(end, start)
+
+        if end >= count:
+            if count - start >= 2:
+                bounds.append((start, count))
+            break
+
+        bounds.append((start, end + 1))
+        start = end + 1
+
+    return bounds
+
+
+def process_track(
+        name: str | None, description: str | None, segments: list[PointArrays], segment_length: float = 1.0,
+        simplify_epsilon: float | None = None, smoothing_window: int = 1, min_elevation_delta: float = 0.0
+) -> tuple[Route, bool]:
+    """
+    Generate the Route of a single GPX track, split into segments of a given maximum length.
+
+    Parameters:
+        name (str | None): The name of the track.
+        description (str | None): The description of the track.
+        segments (list[PointArrays]): The points of each segment of the track.
+        segment_length (float): The maximum length (in kilometers) for each segment in the route.
+        simplify_epsilon (float | None): If given, tracks with more than `SIMPLIFY_MIN_POINTS` points are
+                                         simplified with this Douglas-Peucker tolerance (in decimal degrees).
+        smoothing_window (int): The number of points averaged to smooth elevations. 1 disables smoothing.
+        min_elevation_delta (float): Elevation changes (in meters) below this do not count as gain or loss.
+
+    Returns:
+        tuple[Route, bool]: The route of the track with all its segments, and whether the elevation of all
+                            its points was available. Points without elevation are left out of the route.
+    """
+    is_complete = True
+
+    route = Route()
+    route.name = name
+    route.description = description
 
-            for segment_idx, segment in enumerate(track.segments):
-                route_segment = RouteSegment(segment)
+    for points in segments:
+        # The simplification only uses the coordinates, so it runs first and the elevations
+        # of the discarded points are never requested
+        if simplify_epsilon and len(points) > SIMPLIFY_MIN_POINTS:
+            points = points.take(douglas_peucker(points.latitudes, points.longitudes, simplify_epsilon))
 
-                # Variables for point-to-point calculations
-                previous_point: RoutePoint | None = None
+        # Process points, skipping those without elevation data
+        points, has_all_elevations = get_valid_points(points)
+        is_complete = is_complete and has_all_elevations
 
-                # Process points
-                points = segment.points
-                if any([p.elevation == 0.0 for p in points]):
-                    points = get_points_elevations(points)
+        # Distances and grades of all points are calculated at once
+        data = calculate_distances_and_grades(points, smoothing_window, min_elevation_delta)
 
-                for point_idx, point in enumerate(points):
-                    route_point = RoutePoint(point)
+        bounds = get_segments_bounds(data.cumulative_distances, segment_length)
 
-                    # Skip points without elevation data
-                    if not route_point.has_elevation() or previous_point is None:
-                        previous_point = route_point
-                        continue
+        for route_segment in RouteSegment.from_route_data(data, bounds):
+            route.add_segment(route_segment)
 
-                    route_point.calculate_distance_and_grade(previous_point)
+    return route, is_complete
 
-                    route_segment.calculate_elevation_gain_and_loss(route_point, previous_point)
-                    route_segment.add_point(route_point)
 
-                    # Check if we've completed a segment
-                    if route_segment.is_completed(point_idx, segment_length):
-                        route_segment.calculate_points_data()
+def get_routes(
+        gpx_data: str | bytes | BinaryIO, segment_length: float = 1.0, simplify_epsilon: float | None = None,
+        smoothing_window: int = 1, min_elevation_delta: float = 0.0, use_cache: bool = False
+) -> list[Route] | None:
+    """
+    Parse GPX data and generate a list of Route objects, which are segmented based on a given maximum segment length.
+
+    Parameters:
+        gpx_data (str | bytes | BinaryIO): The GPX data to be processed, provided as a string, as bytes,
+                                           or as a binary file object which is parsed as it is read.
+        segment_length (float): The maximum length (in kilometers) for each segment in the route.
+        simplify_epsilon (float | None): If given, tracks with more than `SIMPLIFY_MIN_POINTS` points are
+                                         simplified with this Douglas-Peucker tolerance (in decimal degrees).
+        smoothing_window (int): The number of points averaged to smooth elevations. 1 disables smoothing.
+        min_elevation_delta (float): Elevation changes (in meters) below this do not count as gain or loss.
+        use_cache (bool): If True, routes are stored on disk, and GPX data already processed with the same
+                          arguments is loaded from there instead of being processed again.
+                          File objects are never cached, as their content is not known before parsing.
 
-                        route.add_segment(route_segment)
-                        route_segment = RouteSegment(segment)
+    Returns:
+        list[Route] | None: A list of Route objects representing the parsed GPX data. Returns None if an error occurs.
+
+    Raises:
+        GPXError: If there is an issue with parsing the GPX data or processing the routes.
 
-                    # Update previous point
-                    previous_point = route_point
+    The function processes the GPX data as follows:
+        1. Stream-parses the GPX data with `iter_tracks`.
+        2. Creates `Route` objects for each track found in the GPX data, processing tracks concurrently.
+        3. Splits tracks into segments (`RouteSegment`) based on the specified maximum length.
+        4. Calculates statistics such as distance, elevation gain/loss, and duration for each segment.
+        5. Adds segments to their respective routes and returns the complete list of routes.
+    """
+    cache_key = None
+    if use_cache and isinstance(gpx_data, (str, bytes)):
+        cache_key = get_cache_key(
+            gpx_data, ROUTES_CACHE_VERSION, segment_length, simplify_epsilon, smoothing_window, min_elevation_delta
+        )
 
-            routes.append(route)
-        return routes
+        routes = load_cache("routes", cache_key)
+        if routes is not None:
+            print("Routes loaded from cache", file=sys.stderr)
+            return routes
 
+    try:
+        # Tracks are independent, so each one is processed in a worker thread while the
+        # following ones are still being parsed; `map` keeps the routes in track order.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(
+                lambda track: process_track(
+                    *track, segment_length, simplify_epsilon, smoothing_window, min_elevation_delta
+                ),
+                iter_tracks(gpx_data),
+            ))
     except Exception as e:
         raise GPXError(f"Error processing GPX file: {e}") from e
+
+    routes = [route for route, _ in results]
+
+    # Routes missing points whose elevation could not be retrieved are not stored, so they are
+    # processed again once the elevation providers are available
+    if cache_key and all(is_complete for _, is_complete in results):
+        save_cache("routes", cache_key, routes)
+
+    return routes
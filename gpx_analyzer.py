@@ -2,19 +2,26 @@ import argparse
 import csv
 import os
 import sys
-from collections import namedtuple
-
-from dotenv import load_dotenv
+from operator import attrgetter
 
 from gpx import get_routes, GPXError, Route
 from provider import is_valid_url, get_gpx_data
+from utils import load_environment
+
+
+# Segment attributes written to the CSV after the segment number, in column order
+get_segment_values = attrgetter(
+    'start_elevation', 'end_elevation', 'min_elevation', 'max_elevation',
+    'distance', 'start_distance', 'end_distance', 'elevation_gain', 'elevation_loss',
+    'avg_grade', 'min_grade', 'max_grade'
+)
 
 
-def write_on_csv(gpx_data_uri, output_file, segment_length):
+def write_on_csv(gpx_data_uri, output_file, segment_length, **route_options):
     gpx_data = get_gpx_data(gpx_data_uri)
 
     try:
-        routes = get_routes(gpx_data, segment_length)
+        routes = get_routes(gpx_data, segment_length, **route_options)
     except GPXError as e:
         print(e, file=sys.stderr)
         return False
@@ -33,26 +40,12 @@ def write_on_csv(gpx_data_uri, output_file, segment_length):
             'Avg Grade', 'Min grade', 'Max grade'
         ]
 
-        rows = []
-        for route in routes:
-            for segment in route.segments:
-                row = [
-                    segment.number,
-                    round(segment.start_elevation, 2),
-                    round(segment.end_elevation, 2),
-                    round(segment.min_elevation, 2),
-                    round(segment.max_elevation, 2),
-                    round(segment.distance, 2),
-                    round(segment.start_distance, 2),
-                    round(segment.end_distance, 2),
-                    round(segment.elevation_gain, 2),
-                    round(segment.elevation_loss, 2),
-                    round(segment.avg_grade, 2),
-                    round(segment.min_grade, 2),
-                    round(segment.max_grade, 2),
-                ]
-
-                rows.append(row)
+        # Segment values are fetched with a single attrgetter call, and the rows are built in one pass
+        rows = [
+            [segment.number, *[round(value, 2) for value in get_segment_values(segment)]]
+            for route in routes
+            for segment in route.segments
+        ]
 
         segment_writer.writerow(columns)
         segment_writer.writerows(rows)
@@ -61,11 +54,11 @@ def write_on_csv(gpx_data_uri, output_file, segment_length):
     return True
 
 
-def print_on_console(gpx_data_uri, output_format, segment_length):
+def print_on_console(gpx_data_uri, output_format, segment_length, **route_options):
     gpx_data = get_gpx_data(gpx_data_uri)
 
     try:
-        routes = get_routes(gpx_data, segment_length)
+        routes = get_routes(gpx_data, segment_length, **route_options)
     except GPXError as e:
         print(e, file=sys.stderr)
         return False
@@ -92,6 +85,9 @@ def print_on_console(gpx_data_uri, output_format, segment_length):
 
 
 def main():
+    # The `.env` files are loaded before any provider reads its keys
+    load_environment()
+
     parser = argparse.ArgumentParser(
         description='Convert GPX data to CSV with 1km segment analysis and AI descriptions')
     parser.add_argument('gpx_file_or_url', help='Path to GPX data')
@@ -100,6 +96,14 @@ def main():
                         default='json', )
     parser.add_argument('-l', '--segment-length', type=float, default=1.0,
                         help='Length of segments in kilometers (default: 1.0)')
+    parser.add_argument('-s', '--simplify', type=float, default=None,
+                        help='Douglas-Peucker tolerance in degrees to simplify tracks with many points (e.g. 1e-5)')
+    parser.add_argument('-w', '--smoothing-window', type=int, default=1,
+                        help='Number of points averaged to smooth elevations (default: 1, no smoothing)')
+    parser.add_argument('-d', '--min-elevation-delta', type=float, default=0.0,
+                        help='Elevation changes in meters ignored for gain/loss (default: 0.0)')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='Reuse the routes processed by previous runs with the same GPX data and options')
 
     args = parser.parse_args()
 
@@ -112,10 +116,17 @@ def main():
 
         args.output = f"{base_name}.csv"
 
+    route_options = {
+        "simplify_epsilon": args.simplify,
+        "smoothing_window": args.smoothing_window,
+        "min_elevation_delta": args.min_elevation_delta,
+        "use_cache": args.cache,
+    }
+
     if args.output == "stdout":
-        result = print_on_console(args.gpx_file_or_url, args.format, args.segment_length)
+        result = print_on_console(args.gpx_file_or_url, args.format, args.segment_length, **route_options)
     else:
-        result = write_on_csv(args.gpx_file_or_url, args.output, args.segment_length)
+        result = write_on_csv(args.gpx_file_or_url, args.output, args.segment_length, **route_options)
 
     if not result:
         print("Failed to process GPX data", file=sys.stderr)
@@ -123,12 +134,4 @@ def main():
 
 
 if __name__ == "__main__":
-    EnvironmentFile = namedtuple("EnvironmentFile", ["file", "override"])
-
-    env_file = EnvironmentFile(".env", False)
-    env_local_file = EnvironmentFile(".env.local", True)
-
-    for ef in [env_file, env_local_file]:
-        load_dotenv(ef.file, override=ef.override)
-
     main()
@@ -1,10 +1,139 @@
 import os
+import re
 import sys
-from typing import Type, TypedDict
-from urllib.parse import urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from operator import itemgetter
+from typing import Callable, Type, TypedDict
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from utils import get_cache_key, load_cache, save_cache
+
+# region HTTP Session
+
+_SESSION: requests.Session | None = None
+_SESSION_LOCK = threading.Lock()
+
+
+class _CappedRetry(Retry):
+    """
+    A retry policy honoring the Retry-After header, but waiting at most `max_retry_after` seconds,
+    so a long delay asked by a rate limited API does not stall the analysis.
+    """
+    max_retry_after = 5
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+
+        return None if retry_after is None else min(retry_after, self.max_retry_after)
+
+
+# Transient failures (rate limits and server errors) are retried with exponential backoff,
+# honoring a short Retry-After header. Elevation lookups are read-only, so POST is retried too.
+_RETRY = _CappedRetry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    raise_on_status=False,
+)
+
+# Seconds to wait for a connection and for the response, so a stalled API does not hang the analysis
+_TIMEOUT = (3, 30)
+
+# Elevation requests sent at the same time across all tracks and batches. Tracks are processed
+# concurrently and each one sends its batches concurrently, so the bound is shared by all of them.
+_MAX_ELEVATION_REQUESTS = 8
+_ELEVATION_REQUESTS = threading.BoundedSemaphore(_MAX_ELEVATION_REQUESTS)
+
+# Connections kept alive per host, enough for the concurrent elevation requests
+_POOL_MAXSIZE = 16
+
+
+def _get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by all providers, creating it on first use.
+
+    Reusing a single session keeps the underlying connections alive between requests,
+    so consecutive calls to the same API skip the TCP and TLS handshakes. Requests that
+    fail with a transient error are retried by the session.
+
+    The session may be first requested from several worker threads at once, so its
+    creation is guarded by a lock.
+
+    Returns:
+        requests.Session: The shared HTTP session.
+    """
+    global _SESSION
+
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+
+                adapter = HTTPAdapter(pool_maxsize=_POOL_MAXSIZE, max_retries=_RETRY)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+
+                _SESSION = session
+
+    return _SESSION
+
+
+# endregion
+
+# region Response Cache
+
+# Seconds for which provider responses are reused from the disk cache
+_RESPONSE_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def _cached_response(namespace: str, get_key: Callable = lambda *args: args):
+    """
+    A decorator to store on disk the responses of a provider classmethod, so runs requesting
+    the same data again, e.g. the elevations of a route analyzed before, skip the API call.
+
+    Responses are reused for `_RESPONSE_CACHE_MAX_AGE` seconds. Caching is skipped when the
+    `GPX_DISABLE_CACHE` environment variable is set.
+
+    Args:
+        namespace (str): The kind of responses stored, used as cache subdirectory.
+        get_key (Callable): Maps the method arguments to the values identifying the response.
+
+    Returns:
+        function: The decorated method, to be wrapped with `classmethod`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(cls, *args):
+            if os.getenv("GPX_DISABLE_CACHE"):
+                return func(cls, *args)
+
+            cache_key = get_cache_key(cls.name, get_key(*args))
+
+            response = load_cache(namespace, cache_key, max_age=_RESPONSE_CACHE_MAX_AGE)
+            if response is None:
+                response = func(cls, *args)
+                save_cache(namespace, cache_key, response)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _get_locations_key(locations: list['Location']) -> list[tuple[float, float]]:
+    # Positions only order the results, so they are left out to reuse responses across routes
+    return [(lo["latitude"], lo["longitude"]) for lo in locations]
+
+
+# endregion
 
 # region GPX Providers
 # This block includes all providers for handling GPX routes.
@@ -27,7 +156,7 @@ class RouteGPXProvider:
     api_url: None
 
     @classmethod
-    def get_route_gpx_data(cls, gpx_uri: str) -> str:
+    def get_route_gpx_data(cls, gpx_uri: str) -> str | bytes:
         """
         A method to be implemented by subclasses to retrieve GPX data from the provider
         based on the provided URI.
@@ -36,7 +165,7 @@ class RouteGPXProvider:
             gpx_uri (str): The URI containing the route information to fetch the GPX data.
     
         Returns:
-            str: The GPX data retrieved from the provider.
+            str | bytes: The GPX data retrieved from the provider.
         """
         pass
 
@@ -52,12 +181,12 @@ class FileRouteGPXProvider(RouteGPXProvider):
     name = "Local File"
 
     @classmethod
-    def get_route_gpx_data(cls, gpx_uri: str) -> str:
+    def get_route_gpx_data(cls, gpx_uri: str) -> bytes:
         try:
-            with open(gpx_uri, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            return "\n".join(lines)
+            # The raw bytes are read in a single call, and the XML parser decodes them
+            # using the encoding declared by the file itself
+            with open(gpx_uri, "rb") as f:
+                return f.read()
         except OSError as e:
             raise GPXProviderError(f"{cls.name}: {e}")
 
@@ -83,14 +212,23 @@ class StravaRouteGPXProvider(RouteGPXProvider):
         }
 
     @classmethod
-    def get_route_gpx_data(cls, gpx_uri: str) -> str:
+    @_cached_response("strava")
+    def get_route_gpx_data(cls, gpx_uri: str) -> bytes:
         route_id = gpx_uri.split("/")[-1]
-        response = requests.get(cls.api_url.format(route_id=route_id), headers=cls.__get_request_headers())
+        try:
+            response = _get_session().get(
+                cls.api_url.format(route_id=route_id), headers=cls.__get_request_headers(), timeout=_TIMEOUT
+            )
+        except requests.RequestException as e:
+            # Timeouts and connection errors, also after the session retries, are reported as provider errors
+            raise GPXProviderError(f"{cls.name}: {e}") from e
 
         if not response.ok:
             raise GPXProviderError(f"{cls.name}: {response.json()['message']}")
 
-        return response.content.decode("utf-8")
+        # The body is returned as received, without decoding a second copy of it into a string;
+        # the XML parser decodes it using the encoding declared by the document
+        return response.content
 
 
 __ROUTE_PROVIDERS = {
@@ -98,25 +236,39 @@ __ROUTE_PROVIDERS = {
 }
 
 
+# Providers are set up once, on first use, after the `.env` files have been loaded
+@lru_cache(maxsize=None)
 def __setting_route_providers():
     if not os.getenv("STRAVA_ACCESS_KEY"):
-        __ROUTE_PROVIDERS.pop("www.strava.com")
+        __ROUTE_PROVIDERS.pop("www.strava.com", None)
+
 
+# A scheme followed by "://" and the network location, which is captured
+_HOSTNAME_RE = re.compile(r"^[a-z][a-z0-9+.-]*://([^/?#]+)", re.IGNORECASE)
 
+# A scheme, a network location and a path, which must at least start with "/"
+_URL_RE = re.compile(r"^[a-z][a-z0-9+.-]*://[^/\s?#]+/", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
 def get_provider_hostname(url: str) -> str:
     """
     Extracts and returns the hostname (netloc) from a given URL.
+
+    Results are memoized, so URIs processed repeatedly are parsed only once.
     
     Args:
         url (str): The URL from which to extract the hostname.
     
     Returns:
-        str: The extracted hostname (netloc) of the given URL.
+        str: The extracted hostname (netloc) of the given URL, or an empty string if it has none.
     """
-    return urlparse(url).netloc
+    match = _HOSTNAME_RE.match(url)
+
+    return match.group(1) if match else ""
 
 
-def is_valid_url(url: str) -> bool | None:
+def is_valid_url(url: str) -> bool:
     """
     Validates whether a given string is a properly formatted URL.
 
@@ -128,17 +280,12 @@ def is_valid_url(url: str) -> bool | None:
         url (str): The URL to validate.
 
     Returns:
-        bool | None: True if the URL is valid, otherwise False.
+        bool: True if the URL is valid, otherwise False.
     """
-    try:
-        result = urlparse(url)
-
-        return all([result.scheme, result.netloc, result.path])
-    except ValueError:
-        pass
+    return bool(url and _URL_RE.match(url))
 
 
-def get_gpx_data(uri: str) -> str | None:
+def get_gpx_data(uri: str) -> str | bytes | None:
     """
     Retrieves GPX data based on the provided URI by delegating the request to the appropriate GPX provider.
 
@@ -152,7 +299,7 @@ def get_gpx_data(uri: str) -> str | None:
                    (e.g., Strava) or a local file path.
 
     Returns:
-        str | None: The retrieved GPX data as a string, or None if the retrieval fails or the URI is invalid.
+        str | bytes | None: The retrieved GPX data, or None if the retrieval fails or the URI is invalid.
     """
     xml_data = None
     try:
@@ -169,6 +316,26 @@ def get_gpx_data(uri: str) -> str | None:
     return xml_data
 
 
+def get_gpx_data_many(uris: list[str], max_concurrent_requests: int = 8) -> list[str | bytes | None]:
+    """
+    Retrieves the GPX data of several URIs, as `get_gpx_data` does for a single one.
+
+    The retrievals are independent and mostly wait on the network, so they run concurrently
+    instead of one after another, with at most `max_concurrent_requests` at the same time
+    to respect the providers' rate limits.
+
+    Args:
+        uris (list[str]): The URIs specifying the sources of the GPX data.
+        max_concurrent_requests (int): The maximum number of retrievals running at the same time.
+
+    Returns:
+        list[str | bytes | None]: The retrieved GPX data of each URI, in the same order as the URIs,
+                                  with None for those whose retrieval fails.
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+        return list(executor.map(get_gpx_data, uris))
+
+
 # endregion
 
 # region Point Elevation Providers
@@ -202,9 +369,31 @@ class PointElevationProvider:
         api_url (str): The API endpoint URL for the elevation provider. This should
                        be specified in subclasses.
         name (str): The name of the elevation provider. This should be specified in subclasses.
+        max_location_per_request (int): The maximum number of locations sent in a single
+                                        request. This should be specified in subclasses.
     """
     name: str
     api_url: None
+    max_location_per_request: int
+
+    @classmethod
+    def _get_locations_per_requests(cls, locations: list[Location]) -> list[list[Location]]:
+        """
+        Splits a list of locations into batches of at most 'max_location_per_request' locations,
+        never producing an empty batch.
+
+        Args:
+            locations (list[Location]): A list of dictionaries containing 'latitude'
+                                        and 'longitude' keys.
+
+        Returns:
+            list[list[Location]]: A list of smaller lists, each containing
+                                  up to 'max_location_per_request' locations.
+        """
+        return [
+            locations[start: start + cls.max_location_per_request]
+            for start in range(0, len(locations), cls.max_location_per_request)
+        ]
 
     @classmethod
     def get_points_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
@@ -238,19 +427,66 @@ class OpenElevationProvider(PointElevationProvider):
     Attributes:
         api_url (str): The API endpoint URL for the Open Elevation service.
         name (str): The name of the elevation provider.
+        max_location_per_request (int): The maximum number of locations sent
+                                        in a single request.
+        max_concurrent_requests (int): The maximum number of requests sent
+                                       to the API at the same time for a list of
+                                       locations. All the requests in progress are
+                                       further bounded by `_MAX_ELEVATION_REQUESTS`.
     """
     name = "Open Elevation API"
     api_url = "https://api.open-elevation.com/api/v1/lookup"
 
+    max_location_per_request = 500
+    max_concurrent_requests = 8
+
     @classmethod
-    def get_points_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
-        response = requests.post(cls.api_url, json={"locations": locations})
+    @_cached_response("elevations", _get_locations_key)
+    def __get_locations_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
+        """
+        Sends a request to the Open Elevation API to fetch elevation data
+        for a given list of locations.
+
+        Args:
+            locations (list[Location]): A list of dictionaries containing 'latitude'
+                                        and 'longitude' keys.
+
+        Returns:
+            list[LocationElevation]: A list of dictionaries containing 'latitude',
+                                      'longitude', and 'elevation' keys.
+
+        Raises:
+            PointElevationError: If the API request fails or returns an error.
+        """
+        try:
+            with _ELEVATION_REQUESTS:
+                response = _get_session().post(cls.api_url, json={"locations": locations}, timeout=_TIMEOUT)
+        except requests.RequestException as e:
+            # Timeouts and connection errors are reported as provider errors, so the next provider is tried
+            raise PointElevationError(f"{cls.name}: {e}") from e
 
         if not response.ok:
             raise PointElevationError(f"{cls.name}: {response.reason}")
 
         return response.json()["results"]
 
+    @classmethod
+    def get_points_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
+        locations_per_request = cls._get_locations_per_requests(locations)
+        location_results = []
+
+        # A single batch is sent directly, without the overhead of a thread pool
+        if len(locations_per_request) == 1:
+            return cls.__get_locations_elevations(locations_per_request[0])
+
+        # Batches are independent, so their requests are sent concurrently; `map` keeps
+        # the results in the same order as the batches.
+        with ThreadPoolExecutor(max_workers=cls.max_concurrent_requests) as executor:
+            for results in executor.map(cls.__get_locations_elevations, locations_per_request):
+                location_results.extend(results)
+
+        return location_results
+
 
 class GoogleElevationProvider(PointElevationProvider):
     """
@@ -265,38 +501,20 @@ class GoogleElevationProvider(PointElevationProvider):
         name (str): The name of the elevation provider.
         max_location_per_request (int): The maximum number of locations that
                                         can be included in a single request.
+        max_concurrent_requests (int): The maximum number of requests sent
+                                       to the API at the same time for a list of
+                                       locations. All the requests in progress are
+                                       further bounded by `_MAX_ELEVATION_REQUESTS`.
     """
     name = "Google Elevation API"
     api_url = "https://maps.googleapis.com/maps/api/elevation/json"
 
     # Reference: https://developers.google.com/maps/documentation/elevation/requests-elevation#Paths
     max_location_per_request = 200
+    max_concurrent_requests = 8
 
     @classmethod
-    def __get_locations_per_requests(cls, locations: list[Location]) -> list[list[Location]]:
-        """
-        Splits a list of locations into smaller batches to adhere to the API's 
-        maximum location limit per request.
-
-        Args:
-            locations (list[Location]): A list of dictionaries containing 'latitude'
-                                        and 'longitude' keys.
-
-        Returns:
-            list[list[Location]]: A list of smaller lists, each containing
-                                  up to 'max_location_per_request' locations.
-        """
-        pages = len(locations) // cls.max_location_per_request + 1
-        locations_per_request = []
-
-        for page in range(pages):
-            locations_per_request.append(
-                locations[page * cls.max_location_per_request: (page + 1) * cls.max_location_per_request]
-            )
-
-        return locations_per_request
-
-    @classmethod
+    @_cached_response("elevations", _get_locations_key)
     def __get_locations_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
         """
         Sends a request to the Google Elevation API to fetch elevation data
@@ -315,10 +533,15 @@ class GoogleElevationProvider(PointElevationProvider):
         """
         locations_data = "|".join([f"{lo['latitude']},{lo['longitude']}" for lo in locations])
 
-        response = requests.get(cls.api_url, params={
-            "locations": locations_data,
-            "key": os.getenv("GOOGLE_ELEVATION_API_KEY")
-        })
+        try:
+            with _ELEVATION_REQUESTS:
+                response = _get_session().get(cls.api_url, params={
+                    "locations": locations_data,
+                    "key": os.getenv("GOOGLE_ELEVATION_API_KEY")
+                }, timeout=_TIMEOUT)
+        except requests.RequestException as e:
+            # Timeouts and connection errors are reported as provider errors, so the next provider is tried
+            raise PointElevationError(f"{cls.name}: {e}") from e
 
         if not response.ok:
             raise PointElevationError(f"{cls.name}: {response.reason}")
@@ -330,13 +553,18 @@ class GoogleElevationProvider(PointElevationProvider):
 
     @classmethod
     def get_points_elevations(cls, locations: list[Location]) -> list[LocationElevation]:
-        locations_per_request = cls.__get_locations_per_requests(locations)
+        locations_per_request = cls._get_locations_per_requests(locations)
         location_results = []
         exception = None
 
-        for locations in locations_per_request:
+        # Batches are independent, so their requests are sent concurrently; results are
+        # then collected in the same order as the batches.
+        with ThreadPoolExecutor(max_workers=cls.max_concurrent_requests) as executor:
+            futures = [executor.submit(cls.__get_locations_elevations, batch) for batch in locations_per_request]
+
+        for future in futures:
             try:
-                location_results.extend(cls.__get_locations_elevations(locations))
+                location_results.extend(future.result())
             except PointElevationError as e:
                 exception = e
 
@@ -351,8 +579,10 @@ __POINT_ELEVATION_PROVIDERS: list[Type[PointElevationProvider]] = [
 ]
 
 
+# Providers are set up once, on first use, after the `.env` files have been loaded
+@lru_cache(maxsize=None)
 def __setting_point_elevation_providers():
-    if os.getenv("GOOGLE_ELEVATION_API_KEY"):
+    if os.getenv("GOOGLE_ELEVATION_API_KEY") and GoogleElevationProvider not in __POINT_ELEVATION_PROVIDERS:
         __POINT_ELEVATION_PROVIDERS.insert(0, GoogleElevationProvider)
 
 
@@ -383,16 +613,34 @@ def get_locations_elevations(locations: list[Location]) -> list[LocationElevatio
     Notes:
         - The locations are sorted by their 'position' key before querying the providers, ensuring
           that the order of the input list is preserved in the results.
+        - Repeated locations are only sent to the providers once.
         - If fetching elevation data fails for all providers, the function returns None.
     """
     elevations = []
 
     __setting_point_elevation_providers()
 
+    # Locations are sorted by position once for all providers, and usually already are
+    get_position = itemgetter("position")
+    if any(get_position(a) > get_position(b) for a, b in zip(locations, locations[1:])):
+        locations = sorted(locations, key=get_position)
+
+    # Locations visited more than once (laps, out-and-back sections) are requested only once,
+    # matching them with a precision of about 1 meter
+    unique_locations: list[Location] = []
+    unique_indexes: dict[tuple[float, float], int] = {}
+    location_indexes = []
+    for location in locations:
+        key = (round(location["latitude"], 5), round(location["longitude"], 5))
+        if key not in unique_indexes:
+            unique_indexes[key] = len(unique_locations)
+            unique_locations.append(location)
+        location_indexes.append(unique_indexes[key])
+
     for provider in __POINT_ELEVATION_PROVIDERS:  # type: PointElevationProvider
         try:
             print(f"{provider.name}: Trying to get points elevations...")
-            elevations = provider.get_points_elevations(sorted(locations, key=lambda lo: lo["position"]))
+            elevations = provider.get_points_elevations(unique_locations)
 
             if elevations:
                 print(f"{provider.name}: Points elevations retrieved successfully!")
@@ -400,6 +648,17 @@ def get_locations_elevations(locations: list[Location]) -> list[LocationElevatio
         except PointElevationError as e:
             print(e, file=sys.stderr)
 
+    # The elevation of each unique location is given back to all the locations matching it
+    if len(unique_locations) < len(locations) and len(elevations) == len(unique_locations):
+        elevations = [
+            LocationElevation(
+                latitude=location["latitude"],
+                longitude=location["longitude"],
+                elevation=elevations[unique_index]["elevation"],
+            )
+            for location, unique_index in zip(locations, location_indexes)
+        ]
+
     return elevations
 
 # endregion
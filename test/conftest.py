@@ -0,0 +1,17 @@
+import pytest
+
+import gpx_analyzer
+import utils
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # Keep the disk cache of every test isolated from the user's cache and from other tests
+    monkeypatch.setattr(utils, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    # Never read the developer's `.env` files, whose keys would make tests call the real APIs
+    monkeypatch.setattr(utils, "load_environment", lambda: None)
+    monkeypatch.setattr(gpx_analyzer, "load_environment", lambda: None)
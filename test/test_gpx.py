@@ -1,6 +1,15 @@
+import io
+import pickle
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import numpy as np
+import pytest
 from gpxpy.gpx import GPXTrackPoint, GPXTrackSegment
 
-from gpx import RoutePoint, RouteSegment
+from gpx import RoutePoint, RouteSegment, Route, PointArrays, RouteData, get_segments_bounds, get_valid_points, iter_tracks
+from gpx import GPXTracksParser, parse_point_time, process_track, calculate_distances_and_grades, SIMPLIFY_MIN_POINTS
+from gpx import get_routes
 
 
 class TestRoutePoint:
@@ -10,8 +19,9 @@ class TestRoutePoint:
         point1 = RoutePoint(GPXTrackPoint(latitude=52.5200, longitude=13.4050, elevation=34.0))
         point2 = RoutePoint(GPXTrackPoint(latitude=52.5201, longitude=13.4051, elevation=54.0))
 
-        # Calculate distance and grade between the two points
-        point1.calculate_distance_and_grade(point2)
+        # Calculate distance and grade between the two points, which is deprecated
+        with pytest.warns(DeprecationWarning, match="calculate_route_geo_data"):
+            point1.calculate_distance_and_grade(point2)
 
         # Validate the calculated distance (rounded for comparison)
         assert round(point1.distance, 5) == 0.01302
@@ -31,6 +41,35 @@ class TestRoutePoint:
         # Validate the calculated elevation difference
         assert abs(elevation_difference) == 20.0
 
+    def test_wraps_gpx_point(self):
+        # Create a RoutePoint from a GPX track point with a name
+        gpx_point = GPXTrackPoint(latitude=52.5200, longitude=13.4050, elevation=34.0, name="Start")
+        point = RoutePoint(gpx_point)
+
+        # Validate the GPX track point is referenced, not copied
+        assert point.gpx_point is gpx_point
+        assert (point.latitude, point.longitude, point.elevation) == (52.5200, 13.4050, 34.0)
+
+        # Validate other attributes and methods are delegated to the GPX track point
+        assert point.name == "Start" and point.has_elevation()
+
+
+class TestPointArrays:
+
+    def test_take(self):
+        # Three points, the second one without elevation
+        points = PointArrays(
+            np.array([52.5200, 52.5201, 52.5202]), np.array([13.4050, 13.4051, 13.4052]),
+            np.array([34.0, np.nan, 54.0]), np.full(3, None, dtype=object)
+        )
+
+        # Select the first and last points
+        selected = points.take(np.array([0, 2]))
+
+        assert len(selected) == 2
+        assert selected.latitudes.tolist() == [52.5200, 52.5202]
+        assert selected.elevations.tolist() == [34.0, 54.0]
+
 
 class TestRouteSegment:
 
@@ -52,3 +91,233 @@ class TestRouteSegment:
 
         # Validate the calculated elevation loss is 0, as it is uphill
         assert abs(segment.elevation_loss) == 20.0
+
+    def test_add_point(self):
+        # Create a RouteSegment and two points with known distances
+        segment = RouteSegment(GPXTrackSegment())
+        point1 = RoutePoint(GPXTrackPoint(elevation=34.0))
+        point1.distance = 0.4
+        point1.grade = 2.0
+        point2 = RoutePoint(GPXTrackPoint(elevation=54.0))
+        point2.distance = 0.6
+        point2.grade = 4.0
+
+        segment.add_point(point1)
+        segment.add_point(point2)
+
+        # Validate the segment distance is the sum of its points distances
+        assert segment.distance == 1.0
+
+        # Validate the elevation statistics once the segment is completed
+        segment.calculate_points_data()
+        assert (segment.min_elevation, segment.max_elevation) == (34.0, 54.0)
+
+        # Validate the grade statistics
+        assert (segment.avg_grade, segment.min_grade, segment.max_grade) == (3.0, 2.0, 4.0)
+
+    def test_is_completed(self):
+        # Create a RouteSegment over a GPX segment of three points
+        segment = RouteSegment(GPXTrackSegment([GPXTrackPoint(elevation=e) for e in (34.0, 44.0, 54.0)]))
+        point = RoutePoint(GPXTrackPoint(elevation=34.0))
+        point.distance = 0.4
+
+        # A single point is not completed, even on the last point of the GPX segment
+        segment.add_point(point)
+        assert not segment.is_completed(1, 1.0)
+        assert not segment.is_completed(2, 1.0)
+
+        # Two points on the last point of the GPX segment complete it
+        segment.add_point(point)
+        assert not segment.is_completed(1, 1.0)
+        assert segment.is_completed(2, 1.0)
+
+        # Reaching the maximum length completes it
+        segment.add_point(point)
+        assert segment.is_completed(1, 1.0)
+
+    def test_from_route_data(self):
+        # Create route data shared by segments, with known distances and grades
+        points = PointArrays(np.zeros(4), np.zeros(4), np.array([10.0, 30.0, 20.0, 25.0]), np.full(4, None))
+        data = RouteData(points, np.array([0.0, 1.0, 1.0, 0.5]), np.array([0.0, 20.0, -10.0, 5.0]),
+                         np.array([0.0, 2.0, -1.0, 1.0]), np.array([0.0, 1.0, 2.0, 2.5]))
+
+        # Calculate a segment over the second point, and another over the last two points
+        first, segment = RouteSegment.from_route_data(data, [(1, 2), (2, 4)])
+        assert (first.distance, first.elevation_gain, first.avg_grade) == (1.0, 20.0, 2.0)
+
+        # Validate the distance is measured from the point before the segment
+        assert segment.distance == 1.5
+        assert (segment.start_elevation, segment.end_elevation) == (20.0, 25.0)
+        assert (segment.min_elevation, segment.max_elevation) == (20.0, 25.0)
+        assert (segment.elevation_gain, segment.elevation_loss) == (5.0, 10.0)
+        assert (segment.avg_grade, segment.min_grade, segment.max_grade) == (0.0, -1.0, 1.0)
+
+
+class TestRoute:
+
+    def test_pickle(self):
+        # Create a Route with a single segment
+        segment = RouteSegment()
+        segment.distance = 1.5
+        segment.duration = "00:10:00"
+        route = Route()
+        route.name = "Route"
+        route.add_segment(segment)
+
+        # Pickle and restore the route, e.g. from the routes cache
+        restored = pickle.loads(pickle.dumps(route))
+
+        # Validate the route and its segments are restored
+        assert restored.__dict__ == route.__dict__
+        assert restored.segments[0].duration == "00:10:00"
+
+
+def test_get_segments_bounds():
+    # Points every 0.4 km along the route
+    cumulative_distances = np.arange(0, 4.0, 0.4)
+
+    # Segments end at the first point reaching 1 km since their previous point
+    assert get_segments_bounds(cumulative_distances, 1.0) == [(1, 4), (4, 7), (7, 10)]
+
+    # The last segment is kept when it has at least two points
+    assert get_segments_bounds(cumulative_distances[:9], 1.0) == [(1, 4), (4, 7), (7, 9)]
+
+    # ...and dropped when it has only one
+    assert get_segments_bounds(cumulative_distances[:8], 1.0) == [(1, 4), (4, 7)]
+
+
+def test_iter_tracks():
+    gpx_data = """<?xml version="1.0" encoding="UTF-8"?>
+    <gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+        <trk>
+            <name>Track</name>
+            <desc>Description</desc>
+            <trkseg>
+                <trkpt lat="52.5200" lon="13.4050"><ele>34.0</ele><time>2024-01-01T08:00:00Z</time></trkpt>
+                <trkpt lat="52.5201" lon="13.4051"></trkpt>
+            </trkseg>
+        </trk>
+    </gpx>"""
+
+    tracks = list(iter_tracks(gpx_data))
+
+    # Validate the track metadata
+    assert len(tracks) == 1
+    name, description, segments = tracks[0]
+    assert (name, description) == ("Track", "Description")
+
+    # Validate the points of the single segment
+    assert len(segments) == 1
+    points = segments[0]
+    assert points.latitudes.tolist() == [52.5200, 52.5201]
+    assert points.elevations[0] == 34.0 and np.isnan(points.elevations[1])
+    assert points.times[0].hour == 8 and points.times[1] is None
+
+    # Validate bytes and binary file objects are parsed the same way
+    for data in (gpx_data.encode("utf-8"), io.BytesIO(gpx_data.encode("utf-8"))):
+        (_, _, (points,)), = iter_tracks(data)
+        assert points.latitudes.tolist() == [52.5200, 52.5201]
+
+    # Validate values split across chunks are read whole
+    with patch.object(GPXTracksParser, "chunk_size", 7):
+        (name, _, (points,)), = iter_tracks(gpx_data)
+        assert name == "Track" and points.elevations[0] == 34.0 and points.times[0].hour == 8
+
+
+def test_parse_point_time():
+    # ISO 8601 times are parsed natively, also with the "Z" suffix
+    assert parse_point_time("2024-01-01T08:00:00.5Z") == datetime(2024, 1, 1, 8, 0, 0, 500000, timezone.utc)
+    with patch("gpx.parse_time") as mock_parse_time:
+        assert parse_point_time("2024-01-01T08:00:00Z") == datetime(2024, 1, 1, 8, 0, 0, tzinfo=timezone.utc)
+        mock_parse_time.assert_not_called()
+
+    # Other formats are parsed by gpxpy
+    assert parse_point_time("2024-01-01T08:00:00.123456789Z").microsecond == 123456
+
+
+def test_get_valid_points():
+    points = PointArrays(
+        np.array([52.5200, 52.5201, 52.5202, 52.5203]), np.array([13.4050, 13.4051, 13.4052, 13.4053]),
+        np.array([34.0, 0.0, np.nan, 54.0]), np.full(4, None, dtype=object)
+    )
+    elevations = [
+        {"latitude": 52.5201, "longitude": 13.4051, "elevation": 40.0},
+        {"latitude": 52.5202, "longitude": 13.4052, "elevation": 45.0},
+    ]
+
+    with patch("gpx.get_locations_elevations", return_value=elevations) as mock_method:
+        valid_points, is_complete = get_valid_points(points)
+
+    # Only the points without a valid elevation are requested
+    assert [lo["position"] for lo in mock_method.call_args.args[0]] == [0, 1]
+
+    # The retrieved elevations fill the gaps
+    assert valid_points.elevations.tolist() == [34.0, 40.0, 45.0, 54.0] and is_complete
+
+    # Points are dropped when their elevation cannot be retrieved
+    with patch("gpx.get_locations_elevations", return_value=[]):
+        valid_points, is_complete = get_valid_points(points)
+        assert valid_points.elevations.tolist() == [34.0, 54.0] and not is_complete
+
+
+def test_calculate_distances_and_grades_min_elevation_delta():
+    # A slow steady climb of 0.25 m every ~5 m
+    count = 2000
+    points = PointArrays(
+        np.linspace(52.5, 52.5 + (count - 1) * 0.000045, count), np.full(count, 13.4),
+        np.arange(count) * 0.25, np.full(count, None, dtype=object)
+    )
+
+    data = calculate_distances_and_grades(points, min_elevation_delta=1.0)
+
+    # The climb is counted in steps of at least 1 m instead of being dropped as noise
+    assert data.elevation_diffs.sum() == pytest.approx(499.0)
+    assert np.all(data.elevation_diffs >= 0)
+
+    # Grades are not affected by the threshold
+    assert data.grades[1:].mean() == pytest.approx(5.0, rel=0.01)
+
+
+def test_process_track_simplified_before_elevations():
+    # A straight track whose points have no elevation
+    count = SIMPLIFY_MIN_POINTS + 1
+    points = PointArrays(
+        52.5 + np.arange(count) * 0.0001, 13.4 + np.arange(count) * 0.0001,
+        np.full(count, np.nan), np.full(count, None, dtype=object)
+    )
+
+    def get_locations_elevations(locations):
+        return [{"latitude": lo["latitude"], "longitude": lo["longitude"], "elevation": 10.0} for lo in locations]
+
+    with patch("gpx.get_locations_elevations", side_effect=get_locations_elevations) as mock_method:
+        process_track("Track", None, [points], simplify_epsilon=0.00001)
+
+    # Only the elevations of the points kept by the simplification are requested
+    assert len(mock_method.call_args.args[0]) == 2
+
+
+def test_get_routes_cache_skips_missing_elevations():
+    gpx_data = """<?xml version="1.0" encoding="UTF-8"?>
+    <gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+        <trk><trkseg>
+            <trkpt lat="52.5200" lon="13.4050"></trkpt>
+            <trkpt lat="52.5210" lon="13.4060"></trkpt>
+            <trkpt lat="52.5220" lon="13.4070"></trkpt>
+        </trkseg></trk>
+    </gpx>"""
+
+    def get_locations_elevations(locations):
+        return [{"latitude": lo["latitude"], "longitude": lo["longitude"], "elevation": 10.0} for lo in locations]
+
+    # Routes missing elevations are not stored...
+    with patch("gpx.get_locations_elevations", return_value=[]):
+        (route,) = get_routes(gpx_data, use_cache=True)
+        assert route.segments == []
+
+    # ...so they are processed again once the elevations are available, and then stored
+    with patch("gpx.get_locations_elevations", side_effect=get_locations_elevations) as mock_method:
+        (route,) = get_routes(gpx_data, use_cache=True)
+        assert len(route.segments) == 1
+
+        (route,) = get_routes(gpx_data, use_cache=True)
+        assert len(route.segments) == 1 and mock_method.call_count == 1
@@ -1,7 +1,84 @@
-from unittest.mock import patch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
 
-from provider import get_locations_elevations, Location, LocationElevation, PointElevationError
-from provider import get_provider_hostname, is_valid_url
+import pytest
+import requests
+from urllib3 import HTTPResponse
+
+import provider
+from provider import get_locations_elevations, Location, LocationElevation, PointElevationError, GPXProviderError
+from provider import OpenElevationProvider, FileRouteGPXProvider, GoogleElevationProvider, StravaRouteGPXProvider
+from provider import get_provider_hostname, is_valid_url, get_gpx_data_many, _get_session
+
+
+class TestHTTPSession:
+
+    def test_get_session_is_reused(self):
+        # The same session must be returned on every call to keep connections alive
+        assert _get_session() is _get_session()
+
+    def test_get_session_is_shared_between_threads(self):
+        # Threads requesting the session before it exists must all get the same one
+        with patch("provider._SESSION", None):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                sessions = list(executor.map(lambda _: _get_session(), range(8)))
+
+        assert all(session is sessions[0] for session in sessions)
+
+    def test_get_session_retries(self):
+        # Rate limited and failed requests are retried
+        retries = _get_session().get_adapter("https://api.open-elevation.com").max_retries
+
+        assert retries.total == 5
+        assert 429 in retries.status_forcelist
+        assert "POST" in retries.allowed_methods
+
+    def test_get_session_retry_after_capped(self):
+        # Long delays asked by a rate limited API are shortened
+        retries = _get_session().get_adapter("https://api.open-elevation.com").max_retries
+
+        assert retries.get_retry_after(HTTPResponse(status=429, headers={"Retry-After": "3600"})) == 5
+        assert retries.get_retry_after(HTTPResponse(status=429, headers={"Retry-After": "2"})) == 2
+        assert retries.new(total=1).get_retry_after(HTTPResponse(status=429, headers={"Retry-After": "3600"})) == 5
+
+    def test_get_session_pool_size(self):
+        # Concurrent elevation requests must not exceed the connections kept alive per host
+        adapter = _get_session().get_adapter("https://api.open-elevation.com")
+
+        assert adapter._pool_maxsize >= provider._MAX_ELEVATION_REQUESTS
+
+    def test_elevation_requests_bounded(self):
+        # Requests from several tracks at once share the same bound
+        lock = threading.Lock()
+        in_progress = []
+        max_in_progress = []
+
+        def post(*args, **kwargs):
+            with lock:
+                in_progress.append(1)
+                max_in_progress.append(len(in_progress))
+            time.sleep(0.01)
+            with lock:
+                in_progress.pop()
+
+            locations = kwargs["json"]["locations"]
+            return MagicMock(ok=True, json=lambda: {"results": [dict(lo, elevation=1.0) for lo in locations]})
+
+        count = OpenElevationProvider.max_location_per_request * 4
+        tracks = [
+            [Location(latitude=track + idx * 1e-6, longitude=0.0, position=idx) for idx in range(count)]
+            for track in range(4)
+        ]
+
+        with patch.dict("os.environ", {"GPX_DISABLE_CACHE": "1"}), \
+                patch.object(_get_session(), "post", side_effect=post):
+            with ThreadPoolExecutor(max_workers=len(tracks)) as executor:
+                list(executor.map(OpenElevationProvider.get_points_elevations, tracks))
+
+        assert len(max_in_progress) == 16
+        assert max(max_in_progress) <= provider._MAX_ELEVATION_REQUESTS
 
 
 class TestRouteProvider:
@@ -14,12 +91,57 @@ class TestRouteProvider:
             ("http://example.com/test", "example.com"),
             ("ftp://files.example.com/resource", "files.example.com"),
             ("invalid_url", ""),  # This will handle cases where the URL is invalid but parsed netloc is empty
+            ("/home/user/route.gpx", ""),  # Local file paths have no hostname
+            ("https://user@example.com:8080/route?id=1", "user@example.com:8080"),
         ]
 
         for url, expected in test_cases:
             # Use get_provider_name and assert that the result matches the expected netloc
             assert get_provider_hostname(url) == expected
 
+    def test_file_route_gpx_data(self, tmp_path):
+        # The file content is returned untouched, keeping its line endings
+        gpx_file = tmp_path / "route.gpx"
+        gpx_file.write_bytes(b'<?xml version="1.0"?>\r\n<gpx>\r\n</gpx>\r\n')
+
+        assert FileRouteGPXProvider.get_route_gpx_data(str(gpx_file)) == gpx_file.read_bytes()
+
+    def test_strava_route_gpx_data(self, monkeypatch):
+        monkeypatch.setenv("STRAVA_ACCESS_KEY", "key")
+
+        session = MagicMock()
+        session.get.return_value = MagicMock(ok=True, content=b"<gpx/>")
+
+        # The GPX data is returned as the bytes received
+        with patch("provider._get_session", return_value=session):
+            assert StravaRouteGPXProvider.get_route_gpx_data("https://www.strava.com/routes/123") == b"<gpx/>"
+
+        assert session.get.call_args.args[0] == "https://www.strava.com/api/v3/routes/123/export_gpx"
+
+    def test_strava_route_gpx_data_timeout(self, monkeypatch):
+        monkeypatch.setenv("STRAVA_ACCESS_KEY", "key")
+        monkeypatch.setenv("GPX_DISABLE_CACHE", "1")
+
+        session = MagicMock()
+        session.get.side_effect = requests.ReadTimeout("Read timed out")
+
+        # Timeouts are reported as provider errors
+        with patch("provider._get_session", return_value=session):
+            with pytest.raises(GPXProviderError, match="Read timed out"):
+                StravaRouteGPXProvider.get_route_gpx_data("https://www.strava.com/routes/123")
+
+    def test_get_gpx_data_many(self, tmp_path):
+        # Create two local GPX files, and a path that does not exist
+        uris = []
+        for idx in range(2):
+            gpx_file = tmp_path / f"route{idx}.gpx"
+            gpx_file.write_bytes(f"<gpx>{idx}</gpx>".encode("utf-8"))
+            uris.append(str(gpx_file))
+        uris.append(str(tmp_path / "missing.gpx"))
+
+        # The GPX data is returned in the same order as the URIs, with None for failures
+        assert get_gpx_data_many(uris) == [b"<gpx>0</gpx>", b"<gpx>1</gpx>", None]
+
     def test_is_valid_url(self):
         # Define test cases with input URLs and their expected validity
         test_cases = [
@@ -30,6 +152,7 @@ class TestRouteProvider:
             ("example.com", False),  # Missing scheme
             ("not-a-valid-url", False),  # Invalid URL
             ("https://", False),  # Missing netloc
+            ("https://example.com", False),  # Missing path
             ("", False),  # Empty string
             (None, False),  # None as input
         ]
@@ -90,3 +213,165 @@ class TestLocationElevationProvider:
             # Capture stderr output
             captured = capfd.readouterr()
             assert "Test exception" in captured.err
+
+    def test_get_location_elevations_timeout_falls_back(self, monkeypatch, capfd):
+        monkeypatch.setenv("GPX_DISABLE_CACHE", "1")
+
+        locations = [Location(latitude=10.0, longitude=20.0, position=0)]
+        elevations = [LocationElevation(latitude=10.0, longitude=20.0, elevation=5.0)]
+
+        # Google times out, so Open Elevation is tried next
+        session = MagicMock()
+        session.get.side_effect = requests.ReadTimeout("Read timed out")
+        session.post.return_value = MagicMock(ok=True, json=lambda: {"results": elevations})
+
+        with patch("provider.__POINT_ELEVATION_PROVIDERS", [GoogleElevationProvider, OpenElevationProvider]), \
+                patch("provider._get_session", return_value=session):
+            result = get_locations_elevations(locations)
+
+        assert result == elevations
+        assert session.get.called and session.post.called
+
+        # The timeout is reported
+        assert "Read timed out" in capfd.readouterr().err
+
+    def test_get_location_elevations_sorted_by_position(self):
+        locations = [Location(latitude=float(idx), longitude=20.0, position=idx) for idx in (2, 0, 1)]
+
+        with patch("provider.OpenElevationProvider.get_points_elevations", return_value=[]) as mock_method:
+            get_locations_elevations(locations)
+
+        # Providers receive the locations ordered by position
+        assert [lo["position"] for lo in mock_method.call_args.args[0]] == [0, 1, 2]
+
+    def test_get_location_elevations_deduplicated(self):
+        # A route going out and back over the same locations
+        coordinates = [(10.0, 20.0), (10.1, 20.1), (10.000001, 20.000001)]
+        locations = [Location(latitude=lat, longitude=lon, position=idx) for idx, (lat, lon) in enumerate(coordinates)]
+
+        def get_points_elevations(unique_locations):
+            return [LocationElevation(latitude=lo["latitude"], longitude=lo["longitude"], elevation=lo["latitude"])
+                    for lo in unique_locations]
+
+        with patch("provider.OpenElevationProvider.get_points_elevations",
+                   side_effect=get_points_elevations) as mock_method:
+            result = get_locations_elevations(locations)
+
+        # Only the unique locations are requested
+        assert len(mock_method.call_args.args[0]) == 2
+
+        # Every location gets an elevation, keeping its own coordinates
+        assert [r["elevation"] for r in result] == [10.0, 10.1, 10.0]
+        assert [(r["latitude"], r["longitude"]) for r in result] == coordinates
+
+    def test_setting_point_elevation_providers_once(self, monkeypatch):
+        monkeypatch.setenv("GOOGLE_ELEVATION_API_KEY", "key")
+        locations = [Location(latitude=10.0, longitude=20.0, position=1)]
+        elevations = [LocationElevation(latitude=10.0, longitude=20.0, elevation=100.0)]
+
+        setting_providers = getattr(provider, "__setting_point_elevation_providers")
+        providers = [OpenElevationProvider]
+
+        setting_providers.cache_clear()
+        with patch("provider.__POINT_ELEVATION_PROVIDERS", providers), \
+                patch("provider.GoogleElevationProvider.get_points_elevations", return_value=elevations):
+            # Repeated calls must not add the Google provider again
+            assert get_locations_elevations(locations) == elevations
+            assert get_locations_elevations(locations) == elevations
+        setting_providers.cache_clear()
+
+        assert providers == [GoogleElevationProvider, OpenElevationProvider]
+
+
+class TestOpenElevationProvider:
+
+    def test_get_points_elevations_in_batches(self):
+        # More locations than fit in a single request
+        locations = [Location(latitude=float(idx), longitude=float(idx), position=idx) for idx in range(1200)]
+
+        def post(url, json, timeout):
+            # Echo back the requested locations with an elevation
+            response = MagicMock(ok=True)
+            response.json.return_value = {
+                "results": [
+                    LocationElevation(latitude=lo["latitude"], longitude=lo["longitude"], elevation=lo["latitude"])
+                    for lo in json["locations"]
+                ]
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+
+        with patch("provider._get_session", return_value=session):
+            result = OpenElevationProvider.get_points_elevations(locations)
+
+        # Assert that the locations were split into batches of 500
+        assert session.post.call_count == 3
+
+        # Assert that the results keep the order of the input locations
+        assert [r["elevation"] for r in result] == [float(idx) for idx in range(1200)]
+
+        # A single batch is requested once as well
+        with patch("provider._get_session", return_value=session):
+            result = OpenElevationProvider.get_points_elevations(locations[:10])
+
+        assert session.post.call_count == 4
+        assert len(result) == 10
+
+    def test_get_points_elevations_cached(self, monkeypatch):
+        locations = [Location(latitude=10.0, longitude=20.0, position=1)]
+
+        session = MagicMock()
+        session.post.return_value.json.return_value = {
+            "results": [LocationElevation(latitude=10.0, longitude=20.0, elevation=100.0)]
+        }
+
+        with patch("provider._get_session", return_value=session):
+            # The same locations are only requested once, even with other positions
+            assert OpenElevationProvider.get_points_elevations(locations)[0]["elevation"] == 100.0
+            assert OpenElevationProvider.get_points_elevations([{**locations[0], "position": 2}])
+            assert session.post.call_count == 1
+
+            # Unless the cache is disabled
+            monkeypatch.setenv("GPX_DISABLE_CACHE", "1")
+            OpenElevationProvider.get_points_elevations(locations)
+            assert session.post.call_count == 2
+
+
+class TestGoogleElevationProvider:
+
+    def test_get_points_elevations_in_batches(self):
+        # More locations than fit in a single request
+        locations = [Location(latitude=float(idx), longitude=float(idx), position=idx) for idx in range(450)]
+
+        def get(url, params, timeout):
+            # Echo back the requested locations with an elevation
+            response = MagicMock(ok=True)
+            response.json.return_value = {
+                "results": [
+                    {"location": {"lat": float(lat), "lng": float(lng)}, "elevation": float(lat)}
+                    for lat, lng in (lo.split(",") for lo in params["locations"].split("|"))
+                ]
+            }
+            return response
+
+        session = MagicMock()
+        session.get.side_effect = get
+
+        with patch("provider._get_session", return_value=session):
+            result = GoogleElevationProvider.get_points_elevations(locations)
+
+        # Assert that the locations were split into batches of 200
+        assert session.get.call_count == 3
+
+        # Assert that the results keep the order of the input locations
+        assert [r["elevation"] for r in result] == [float(idx) for idx in range(450)]
+
+    def test_get_locations_per_requests(self):
+        # A number of locations multiple of the batch size must not produce an empty batch
+        locations = [Location(latitude=float(idx), longitude=float(idx), position=idx) for idx in range(400)]
+
+        assert [len(b) for b in GoogleElevationProvider._get_locations_per_requests(locations[:200])] == [200]
+        assert [len(b) for b in GoogleElevationProvider._get_locations_per_requests(locations)] == [200, 200]
+        assert GoogleElevationProvider._get_locations_per_requests([]) == []
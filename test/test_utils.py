@@ -1,11 +1,62 @@
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pytest
 
 import utils
 
 
+def test_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "CACHE_DIR", str(tmp_path))
+
+    # Keys depend on both the data and the arguments
+    key = utils.get_cache_key("<gpx/>", 1.0)
+    assert key == utils.get_cache_key(b"<gpx/>", 1.0)
+    assert key != utils.get_cache_key("<gpx/>", 2.0)
+
+    # Missing values are returned as None
+    assert utils.load_cache("test", key) is None
+
+    # Stored values are loaded back
+    utils.save_cache("test", key, {"distance": 1.0})
+    assert utils.load_cache("test", key) == {"distance": 1.0}
+
+    # Values older than the maximum age are expired
+    assert utils.load_cache("test", key, max_age=60) == {"distance": 1.0}
+    assert utils.load_cache("test", key, max_age=-1) is None
+
+    # Values that cannot be unpickled, e.g. stored by another version, are missing
+    (tmp_path / "test" / f"{key}.pickle").write_bytes(b"\x80\x05cmissing_module\nValue\n.")
+    assert utils.load_cache("test", key) is None
+
+
+def test_save_cache_concurrent(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "CACHE_DIR", str(tmp_path))
+
+    # Writers of the same key never publish each other's partial files
+    value = list(range(100000))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: utils.save_cache("test", "key", value), range(32)))
+
+    assert utils.load_cache("test", "key") == value
+    assert [path.name for path in (tmp_path / "test").iterdir()] == ["key.pickle"]
+
+
+def test_get_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "CACHE_DIR", None)
+
+    # The directory is resolved on first use, after the `.env` files have been loaded
+    monkeypatch.setenv("GPX_ANALYZER_CACHE_DIR", str(tmp_path / "env-cache"))
+
+    utils.save_cache("test", "key", 1)
+    assert (tmp_path / "env-cache" / "test" / "key.pickle").exists()
+
+
 def test_haversine():
     # Test case 1: Same points, distance should be 0
     assert utils.haversine(0, 0, 0, 0) == 0
+    assert utils.haversine(52.5200, 13.4050, 52.5200, 13.4050) == 0
 
     # Test case 2: Known distance between two points
     assert round(utils.haversine(36.12, -86.67, 33.94, -118.40), 2) == 2886.44
@@ -14,6 +65,22 @@ def test_haversine():
     assert round(utils.haversine(52.5200, 13.4050, 52.5201, 13.4051), 5) == 0.01302
 
 
+def test_haversine_path():
+    latitudes = np.array([36.12, 33.94, 52.5200, 52.5201])
+    longitudes = np.array([-86.67, -118.40, 13.4050, 13.4051])
+
+    # Distances between consecutive points match the scalar implementation
+    expected = [utils.haversine(latitudes[i], longitudes[i], latitudes[i + 1], longitudes[i + 1]) for i in range(3)]
+    assert np.allclose(utils.haversine_path(latitudes, longitudes), expected)
+
+    # The short hop uses the equirectangular approximation, which stays within a millimeter
+    # of the haversine formula
+    lat1, lon1, lat2, lon2 = np.radians([latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    exact = 2 * 6371 * np.arcsin(np.sqrt(a))
+    assert np.allclose(utils.haversine_path(latitudes, longitudes), exact, rtol=0, atol=1e-6)
+
+
 def test_calculate_gradient():
     # Test case 1: Gradient is zero when distance is zero
     assert utils.calculate_gradient(0, 10) == 0
@@ -25,6 +92,62 @@ def test_calculate_gradient():
     assert utils.calculate_gradient(1, -50) == -5.0
 
 
+def test_calculate_route_geo_data():
+    latitudes = np.array([52.5200, 52.5201, 52.5201])
+    longitudes = np.array([13.4050, 13.4051, 13.4051])
+    elevations = np.array([34.0, 54.0, 50.0])
+
+    geo_data = utils.calculate_route_geo_data(latitudes, longitudes, elevations)
+    distances, elevation_diffs, gradients = geo_data
+
+    # Values are also accessible by name
+    assert geo_data.distances is distances and geo_data.gradients is gradients
+
+    # The first point has no previous point
+    assert (distances[0], elevation_diffs[0], gradients[0]) == (0, 0, 0)
+
+    # Values match the scalar implementations
+    assert round(distances[1], 5) == 0.01302 and elevation_diffs[1] == 20.0
+    assert gradients[1] == utils.calculate_gradient(distances[1], 20.0)
+
+    # Gradient is zero when the distance is zero
+    assert (distances[2], elevation_diffs[2], gradients[2]) == (0, -4.0, 0)
+
+
+def test_moving_average():
+    # Test case 1: A window of 1 leaves the values unchanged
+    values = np.array([1.0, 4.0, 1.0, 4.0])
+    assert utils.moving_average(values, 1).tolist() == [1.0, 4.0, 1.0, 4.0]
+
+    # Test case 2: Values are averaged with their neighbours, repeating the ends
+    assert np.allclose(utils.moving_average(values, 3), [2.0, 2.0, 3.0, 3.0])
+
+
+def test_filter_elevation_diffs():
+    # Test case 1: Oscillations smaller than the threshold are ignored
+    elevations = np.array([10.0, 10.5, 10.0, 10.5, 10.0])
+    assert utils.filter_elevation_diffs(elevations, 1.0).tolist() == [0.0] * 5
+
+    # Test case 2: Changes are counted from the last counted elevation, so slow climbs add up
+    elevations = np.array([10.0, 10.4, 10.8, 11.2, 11.6, 12.0, 11.5])
+    assert np.allclose(utils.filter_elevation_diffs(elevations, 1.0), [0, 0, 0, 1.2, 0, 0, 0])
+
+
+def test_douglas_peucker():
+    # Test case 1: Points on a straight line are reduced to the ends
+    latitudes = np.array([0.0, 1.0, 2.0, 3.0])
+    longitudes = np.array([0.0, 1.0, 2.0, 3.0])
+    assert utils.douglas_peucker(latitudes, longitudes, 0.01).tolist() == [0, 3]
+
+    # Test case 2: A point deviating more than epsilon is kept
+    latitudes = np.array([0.0, 1.0, 0.0, 0.0])
+    longitudes = np.array([0.0, 1.0, 2.0, 3.0])
+    assert utils.douglas_peucker(latitudes, longitudes, 0.5).tolist() == [0, 1, 3]
+
+    # Test case 3: ...but not when it is within epsilon
+    assert utils.douglas_peucker(latitudes, longitudes, 2.0).tolist() == [0, 3]
+
+
 def test_deprecated():
     @utils.deprecated(reason="Test function is deprecated")
     def old_function():
@@ -33,3 +156,8 @@ def test_deprecated():
     # Check if the warning is raised
     with pytest.warns(DeprecationWarning, match="Test function is deprecated"):
         assert old_function() == "This is old"
+
+    # The warning is only issued once for the same caller
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert old_function() == "This is old"
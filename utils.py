@@ -1,14 +1,64 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
 import warnings
-from functools import wraps
+from functools import lru_cache, wraps
+from typing import NamedTuple
 
 import math
+import numpy as np
+from dotenv import load_dotenv
+
+# Points closer than this (in decimal degrees, about 1 km) are measured with the equirectangular
+# approximation, which at such distances differs from the haversine formula by far less than a meter
+EQUIRECTANGULAR_MAX_DELTA = 0.01
+
+_EARTH_RADIUS = 6371  # Radius of earth in kilometers
+_DEGREES_TO_RADIANS = math.pi / 180
+
+# Directory of the disk cache, resolved on first use so it can also be set in the `.env` files
+# loaded by the command line entry point
+CACHE_DIR: str | None = None
+
+
+@lru_cache(maxsize=None)
+def load_environment():
+    """
+    Load the `.env` file and then the `.env.local` file, whose values take precedence,
+    into the environment variables. The files are only read once.
+
+    Only the command line entry point calls it, so the library never reads the files of
+    the working directory on its own.
+    """
+    load_dotenv(".env", override=False)
+    load_dotenv(".env.local", override=True)
+
+
+def get_cache_dir() -> str:
+    """
+    Get the directory of the disk cache, from the `GPX_ANALYZER_CACHE_DIR` environment variable
+    or `~/.cache/gpx-analyzer` by default.
+
+    Returns:
+        str: The path of the cache directory.
+    """
+    global CACHE_DIR
+
+    if CACHE_DIR is None:
+        CACHE_DIR = os.getenv("GPX_ANALYZER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpx-analyzer"))
+
+    return CACHE_DIR
 
 
 def deprecated(reason="This method is deprecated and will be removed in future versions."):
     """
     A decorator to mark functions as deprecated with an optional reason.
 
-    When the decorated function is called, a `DeprecationWarning` is issued.
+    When the decorated function is called, a `DeprecationWarning` is issued once per calling code,
+    so calling it inside a loop doesn't go through the warnings machinery on every iteration.
 
     Parameters:
         reason (str): A message explaining why the function is deprecated and 
@@ -19,13 +69,18 @@ def deprecated(reason="This method is deprecated and will be removed in future v
     """
 
     def decorator(func):
+        warned_callers = set()
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            warnings.warn(
-                f"{func.__name__} is deprecated: {reason}",
-                category=DeprecationWarning,
-                stacklevel=2
-            )
+            caller = sys._getframe(1).f_code
+            if caller not in warned_callers:
+                warned_callers.add(caller)
+                warnings.warn(
+                    f"{func.__name__} is deprecated: {reason}",
+                    category=DeprecationWarning,
+                    stacklevel=2
+                )
             return func(*args, **kwargs)
 
         return wrapper
@@ -33,6 +88,78 @@ def deprecated(reason="This method is deprecated and will be removed in future v
     return decorator
 
 
+def get_cache_key(data: str | bytes, *args) -> str:
+    """
+    Build a cache key from some data and the arguments used to process it.
+
+    Parameters:
+        data (str | bytes): The data being processed, e.g. the content of a GPX file.
+        *args: Any other values the result depends on.
+
+    Returns:
+        str: A SHA-256 hex digest identifying the data and arguments.
+    """
+    digest = hashlib.sha256(data.encode("utf-8") if isinstance(data, str) else data)
+    digest.update(repr(args).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def load_cache(namespace: str, key: str, max_age: float | None = None):
+    """
+    Load a value previously stored with `save_cache`.
+
+    Parameters:
+        namespace (str): The kind of values stored, used as cache subdirectory.
+        key (str): The key of the value, as returned by `get_cache_key`.
+        max_age (float | None): If given, values stored more than this number of seconds ago are
+                                considered expired.
+
+    Returns:
+        The cached value, or None if it is not cached, has expired or cannot be read.
+    """
+    path = os.path.join(get_cache_dir(), namespace, f"{key}.pickle")
+
+    try:
+        if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+            return None
+
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # Unreadable files and values pickled by incompatible versions are treated as missing
+        return None
+
+
+def save_cache(namespace: str, key: str, value):
+    """
+    Store a value on disk so it can be loaded by later runs with `load_cache`.
+
+    Parameters:
+        namespace (str): The kind of values stored, used as cache subdirectory.
+        key (str): The key of the value, as returned by `get_cache_key`.
+        value: The value to store. It must be picklable.
+    """
+    directory = os.path.join(get_cache_dir(), namespace)
+    path = os.path.join(directory, f"{key}.pickle")
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file of its own first, so neither a concurrent reader nor a
+        # concurrent writer of the same key ever sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
 def haversine(lat1, lon1, lat2, lon2):
     """
     Calculate the great circle distance between two points on the Earth's surface.
@@ -46,16 +173,67 @@ def haversine(lat1, lon1, lat2, lon2):
     Returns:
         float: The distance between the two points in kilometers.
     """
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    # Repeated locations, e.g. while stopped, are common in recorded tracks
+    if lat1 == lat2 and lon1 == lon2:
+        return 0.0
+
+    # Only the differences and the latitudes are needed in radians
+    diff_latitude = (lat2 - lat1) * _DEGREES_TO_RADIANS
+    diff_longitude = (lon2 - lon1) * _DEGREES_TO_RADIANS
+
+    # Nearby points, the usual case along a track, skip the trigonometry of the haversine formula
+    if abs(lat2 - lat1) < EQUIRECTANGULAR_MAX_DELTA and abs(lon2 - lon1) < EQUIRECTANGULAR_MAX_DELTA:
+        x = diff_longitude * math.cos((lat1 + lat2) * (_DEGREES_TO_RADIANS / 2))
+        return _EARTH_RADIUS * math.sqrt(x * x + diff_latitude * diff_latitude)
 
     # Haversine formula
-    diff_longitude = lon2 - lon1
-    diff_latitude = lat2 - lat1
-    a = math.sin(diff_latitude / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(diff_longitude / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371  # Radius of earth in kilometers
-    return c * r
+    sin_latitude = math.sin(diff_latitude / 2)
+    sin_longitude = math.sin(diff_longitude / 2)
+    a = (
+            sin_latitude * sin_latitude
+            + math.cos(lat1 * _DEGREES_TO_RADIANS) * math.cos(lat2 * _DEGREES_TO_RADIANS) * sin_longitude * sin_longitude
+    )
+    return 2 * _EARTH_RADIUS * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def haversine_path(latitudes, longitudes):
+    """
+    Calculate the great circle distances between consecutive points of a path.
+
+    Equivalent to calling `haversine` on each pair of consecutive points, but all the pairs are
+    processed at once, and each latitude is converted to radians and its cosine computed only once,
+    even though every inner point takes part in two distances. Hops shorter than `EQUIRECTANGULAR_MAX_DELTA`
+    use the equirectangular approximation, and only longer ones the full haversine formula.
+
+    Parameters:
+        latitudes (np.ndarray): Latitudes of the path points in decimal degrees.
+        longitudes (np.ndarray): Longitudes of the path points in decimal degrees.
+
+    Returns:
+        np.ndarray: The distances between each point and the next one in kilometers.
+    """
+    latitudes = np.radians(latitudes)
+    longitudes = np.radians(longitudes)
+    cos_latitudes = np.cos(latitudes)
+
+    diff_longitude = np.diff(longitudes)
+    diff_latitude = np.diff(latitudes)
+    cos_products = cos_latitudes[:-1] * cos_latitudes[1:]
+
+    # Equirectangular approximation, with the product of both cosines standing for the squared
+    # cosine of the mean latitude, so no extra trigonometric function is evaluated
+    distances = _EARTH_RADIUS * np.sqrt(diff_latitude ** 2 + cos_products * diff_longitude ** 2)
+
+    # Haversine formula for the few long hops
+    max_delta = math.radians(EQUIRECTANGULAR_MAX_DELTA)
+    long_hops = (np.abs(diff_latitude) >= max_delta) | (np.abs(diff_longitude) >= max_delta)
+    if long_hops.any():
+        diff_longitude = diff_longitude[long_hops]
+        diff_latitude = diff_latitude[long_hops]
+        a = np.sin(diff_latitude / 2) ** 2 + cos_products[long_hops] * np.sin(diff_longitude / 2) ** 2
+        distances[long_hops] = 2 * np.arcsin(np.sqrt(a)) * _EARTH_RADIUS
+
+    return distances
 
 
 def calculate_gradient(distance, elevation_diff):
@@ -74,3 +252,156 @@ def calculate_gradient(distance, elevation_diff):
 
     # Convert distance to meters for gradient calculation
     return (elevation_diff / (distance * 1000)) * 100
+
+
+def calculate_gradient_vec(distances, elevation_diffs):
+    """
+    Calculate the gradients of several slopes as percentages.
+
+    Vectorized version of `calculate_gradient` that processes whole arrays at once.
+
+    Parameters:
+        distances (np.ndarray): Horizontal distances in kilometers.
+        elevation_diffs (np.ndarray): Differences in elevation in meters.
+
+    Returns:
+        np.ndarray: The gradients as percentages. Gradients are 0 where the distance is 0.
+    """
+    gradients = np.zeros_like(distances, dtype=np.float64)
+
+    # Convert distances to meters for gradient calculation
+    np.divide(elevation_diffs, distances * 1000, out=gradients, where=distances != 0)
+    return gradients * 100
+
+
+class RouteGeoData(NamedTuple):
+    """
+    Distances, elevation differences and gradients of the points of a route.
+    """
+    distances: np.ndarray
+    elevation_diffs: np.ndarray
+    gradients: np.ndarray
+
+
+def calculate_route_geo_data(latitudes, longitudes, elevations):
+    """
+    Calculate the distance, elevation difference and gradient of every point of a route
+    relative to its previous point, processing all the points at once.
+
+    Parameters:
+        latitudes (np.ndarray): Latitudes of the route points in decimal degrees.
+        longitudes (np.ndarray): Longitudes of the route points in decimal degrees.
+        elevations (np.ndarray): Elevations of the route points in meters.
+
+    Returns:
+        RouteGeoData: The distances in kilometers, the elevation differences in meters and the
+        gradients as percentages of each point. The first point has no previous point, so its
+        values are 0.
+    """
+    distances = np.zeros(len(latitudes), dtype=np.float64)
+    elevation_diffs = np.zeros(len(latitudes), dtype=np.float64)
+
+    if len(latitudes) > 1:
+        distances[1:] = haversine_path(latitudes, longitudes)
+        elevation_diffs[1:] = np.diff(elevations)
+
+    return RouteGeoData(distances, elevation_diffs, calculate_gradient_vec(distances, elevation_diffs))
+
+
+def moving_average(values, window):
+    """
+    Smooth a series of values with a centered moving average.
+
+    Parameters:
+        values (np.ndarray): The values to smooth.
+        window (int): The number of values averaged for each point. A window of 1 or less
+                      returns the values unchanged.
+
+    Returns:
+        np.ndarray: The smoothed values, with the same length as the input. The series is
+                    padded with its first and last values so its ends are not pulled to 0.
+    """
+    if window <= 1 or len(values) == 0:
+        return values
+
+    padded = np.pad(values, (window // 2, (window - 1) // 2), mode="edge")
+    return np.convolve(padded, np.ones(window) / window, mode="valid")
+
+
+def filter_elevation_diffs(elevations, min_delta):
+    """
+    Calculate the elevation difference of every point relative to its previous point, ignoring
+    changes smaller than a threshold with hysteresis.
+
+    A reference elevation is kept, and a difference is only counted once the profile has moved at
+    least `min_delta` away from it, which then becomes the new reference. Small oscillations are
+    discarded, while slow steady climbs and descents still add up.
+
+    Parameters:
+        elevations (np.ndarray): Elevations of the route points in meters.
+        min_delta (float): The minimum elevation change (in meters) counted as gain or loss.
+
+    Returns:
+        np.ndarray: The elevation differences in meters, with the same length as the input. The
+                    first point has no previous point, so its difference is 0.
+    """
+    diffs = [0.0] * len(elevations)
+
+    if len(elevations):
+        values = elevations.tolist()
+        reference = values[0]
+
+        for idx in range(1, len(values)):
+            delta = values[idx] - reference
+            if abs(delta) >= min_delta:
+                diffs[idx] = delta
+                reference = values[idx]
+
+    return np.array(diffs, dtype=np.float64)
+
+
+def douglas_peucker(latitudes, longitudes, epsilon):
+    """
+    Simplify a path with the Douglas-Peucker algorithm, keeping only the points that deviate
+    more than `epsilon` from the simplified path.
+
+    Parameters:
+        latitudes (np.ndarray): Latitudes of the path points in decimal degrees.
+        longitudes (np.ndarray): Longitudes of the path points in decimal degrees.
+        epsilon (float): The maximum allowed deviation in decimal degrees.
+
+    Returns:
+        np.ndarray: The sorted indexes of the points to keep. The first and last points are always kept.
+    """
+    count = len(latitudes)
+    if count < 3:
+        return np.arange(count)
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Ranges are processed with an explicit stack, so long paths do not hit the recursion limit
+    ranges = [(0, count - 1)]
+    while ranges:
+        start, end = ranges.pop()
+        if end - start < 2:
+            continue
+
+        x = longitudes[start + 1:end] - longitudes[start]
+        y = latitudes[start + 1:end] - latitudes[start]
+        dx = longitudes[end] - longitudes[start]
+        dy = latitudes[end] - latitudes[start]
+
+        # Distance of each inner point to the segment between the range ends
+        length = dx * dx + dy * dy
+        t = np.clip((x * dx + y * dy) / length, 0, 1) if length else 0
+        deviations = np.hypot(x - t * dx, y - t * dy)
+
+        farthest = int(np.argmax(deviations))
+        if deviations[farthest] > epsilon:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            ranges.append((start, middle))
+            ranges.append((middle, end))
+
+    return np.flatnonzero(keep)